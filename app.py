@@ -1,35 +1,105 @@
-from http.client import HTTPException
+import asyncio
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
 import random
+import time
+from typing import Optional
+import uuid
 from dotenv import load_dotenv
-from fastapi import BackgroundTasks, FastAPI
-from web3 import Web3
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
-from models import Restaurant, Review, User
-from firedantic import configure
+from models import InvalidCursor, Job, Restaurant, Review, User
+from firedantic import ModelNotFoundError, configure
 from google.cloud.firestore import Client
 import os
-from abi import tummy_abi, erc6551_registry_abi, erc6551_account_abi
+from eth_utils import to_checksum_address
+from erc6551 import account_address
+from jobs import get_job_queue, job_id, track_queue_depth
+from metrics import REQUEST_SECONDS, STARTUP_SECONDS, time_firestore
+import repository
+from restaurant_cache import CachedPayload, restaurant_cache
+from spatial_index import restaurant_index
 
 load_dotenv()
 client = Client()
 
 configure(client, prefix="snacks-")
+job_queue = get_job_queue()
+track_queue_depth(job_queue)
 
-app = FastAPI()
-w3 = Web3(Web3.HTTPProvider(os.environ["RPC_HTTP_URL"]))
-private_key = os.environ["DEPLOYER_PRIVATE_KEY"]
-tummy_contract_instance = w3.eth.contract(
-    address=os.environ["TUMMY_NFT_ADDRESS"], abi=tummy_abi
-)
-proof_of_snack_contract_instance = w3.eth.contract(
-    address=os.environ["PROOF_OF_SNACK_NFT_ADDRESS"], abi=tummy_abi
-)
-erc6551_registry_instance = w3.eth.contract(
-    address=os.environ["ERC6551_REGISTRY_ADDRESS"], abi=erc6551_registry_abi
-)
-erc6551_account_instance = w3.eth.contract(
-    address=os.environ["ERC6551_ACCOUNT_ADDRESS"], abi=erc6551_account_abi
-)
+
+def build_restaurant_index() -> None:
+    restaurant_index.build(restaurant_cache.get_all().value)
+
+
+def get_chain():
+    # Importing web3 is most of this module's import time, so it waits for the first chain use
+    import chain
+
+    return chain.get_chain()
+
+
+def warm_chain() -> None:
+    # Resolves the chain ID up front, web3 checks it before every call and caches it
+    get_chain().w3.eth.chain_id
+
+
+async def set_up_chain() -> None:
+    try:
+        await asyncio.to_thread(warm_chain)
+    except Exception as e:
+        # Chain routes and jobs retry the setup on first use
+        print(f"Failed to set up chain clients: {e!r}")
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    started = time.perf_counter()
+    # Runs in the background: routes that don't touch the chain are served in the meantime
+    chain_setup = asyncio.create_task(set_up_chain())
+    restaurant_cache.add_listener(restaurant_index.apply_change)
+    try:
+        await repository.run_sync(restaurant_cache.warm)
+        await repository.run_sync(build_restaurant_index)
+        restaurant_cache.watch()
+    except Exception as e:
+        # The cache fills itself on first use, a failed warm-up must not block startup
+        print(f"Failed to warm restaurant cache: {e}")
+    STARTUP_SECONDS.labels("lifespan").set(time.perf_counter() - started)
+    yield
+    chain_setup.cancel()
+    restaurant_cache.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next) -> Response:
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template, not the raw path, to keep the number of series bounded
+    route = request.scope.get("route")
+    REQUEST_SECONDS.labels(
+        request.method,
+        route.path if route is not None else "unmatched",
+        response.status_code,
+    ).observe(time.perf_counter() - started)
+    return response
+
+
+def tummy_6551_account(tummy_token_id: int) -> str:
+    # Same address as erc6551_registry_instance.functions.account(...), computed locally
+    chain = get_chain()
+    return account_address(
+        chain.erc6551_registry_instance.address,
+        chain.erc6551_account_instance.address,
+        chain.chain_id,
+        chain.tummy_contract_instance.address,
+        tummy_token_id,
+        1,
+    )
 
 
 BASE_TUMMIES_URIS = [
@@ -38,195 +108,462 @@ BASE_TUMMIES_URIS = [
 ]
 
 
-@app.get("/restaurants")
-async def get_restaurants() -> list[Restaurant]:
-    return Restaurant.find()
+def cached_response(request: Request, payload: CachedPayload) -> Response:
+    # Lets clients that send back the ETag skip downloading an unchanged payload
+    if_none_match = request.headers.get("if-none-match", "")
+    etags = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+    if payload.etag in etags or "*" in etags:
+        return Response(status_code=304, headers={"ETag": payload.etag})
+    return Response(
+        content=payload.body,
+        media_type="application/json",
+        headers={"ETag": payload.etag},
+    )
+
+
+@app.get("/restaurants", response_model=list[Restaurant])
+async def get_restaurants(request: Request) -> Response:
+    return cached_response(request, await repository.get_cached_restaurants())
+
+
+@app.get("/restaurants/nearby")
+async def get_nearby_restaurants(
+    lat: float = Query(ge=-90, le=90),
+    lon: float = Query(ge=-180, le=180),
+    radius: float = Query(1000, gt=0, le=50000),
+    cuisine: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+) -> list[Restaurant]:
+    if not restaurant_index.built:
+        await repository.run_sync(build_restaurant_index)
+    return [
+        restaurant
+        for _, restaurant in restaurant_index.nearby(lat, lon, radius, cuisine, limit)
+    ]
 
 
-@app.get("/restaurants/{restaurant_id}")
-async def get_restaurant(restaurant_id: str) -> Restaurant:
-    return Restaurant.get_by_doc_id(restaurant_id)
+@app.get("/restaurants/{restaurant_id}", response_model=Restaurant)
+async def get_restaurant(restaurant_id: str, request: Request) -> Response:
+    return cached_response(
+        request, await repository.get_cached_restaurant(restaurant_id)
+    )
 
 
 @app.post("/reviews/new")
 async def post_review(
     wallet_address: str, restaurant_id: str, rating: float, text: str
 ) -> None:
-    user = User.find_one({"wallet_address": wallet_address})
+    # Ensure address is checksummed
+    wallet_address = to_checksum_address(wallet_address)
+    user = await repository.get_user(wallet_address)
     if restaurant_id not in user.visited_restaurants:
-        raise HTTPException("User has not visited this restaurant")
+        raise HTTPException(
+            status_code=403, detail="User has not visited this restaurant"
+        )
     review = Review(
         wallet_address=wallet_address,
         restaurant_id=restaurant_id,
         rating=rating,
         text=text,
+        created_at=time.time(),
     )
-    restaurant = Restaurant.get_by_doc_id(restaurant_id)
-    restaurant.reviews.append(review)
-    restaurant.save()
-    user.reviews.append(review)
-    user.save()
+    await repository.firestore_call("reviews.create", review.create)
+    restaurant_cache.invalidate(restaurant_id)
+
+
+REVIEWS_PAGE_SIZE = 20
+
+
+async def reviews_page(
+    response: Response, field: str, value: str, limit: int, cursor: Optional[str]
+) -> list[Review]:
+    try:
+        reviews, next_cursor = await repository.get_reviews_page(
+            field, value, limit, cursor
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+    # The body stays a plain list of reviews, the cursor for the next page travels in a header
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return reviews
 
 
 @app.get("/restaurants/{restaurant_id}/reviews")
-async def get_reviews(restaurant_id: str) -> list[Review]:
-    return Restaurant.get_by_doc_id(restaurant_id).reviews
+async def get_reviews(
+    restaurant_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(REVIEWS_PAGE_SIZE, ge=1, le=100),
+) -> list[Review]:
+    return await reviews_page(response, "restaurant_id", restaurant_id, limit, cursor)
 
 
 @app.get("/users/{wallet_address}/reviews")
-async def get_reviews(wallet_address: str) -> list[Review]:
+async def get_user_reviews(
+    wallet_address: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(REVIEWS_PAGE_SIZE, ge=1, le=100),
+) -> list[Review]:
     # Ensure address is checksummed
-    wallet_address = w3.to_checksum_address(wallet_address)
-    return User.find_one({"wallet_address": wallet_address}).reviews
+    wallet_address = to_checksum_address(wallet_address)
+    return await reviews_page(response, "wallet_address", wallet_address, limit, cursor)
 
 
 @app.get("/users/{wallet_address}")
-async def get_user(wallet_address: str, background_tasks: BackgroundTasks) -> User:
+async def get_user(wallet_address: str, response: Response) -> User:
     # Ensure address is checksummed
-    wallet_address = w3.to_checksum_address(wallet_address)
+    wallet_address = to_checksum_address(wallet_address)
     try:
-        return User.find_one({"wallet_address": wallet_address})
-    except Exception:
+        return await repository.get_user(wallet_address)
+    except ModelNotFoundError:
         # We need to create a new user
         user = User(wallet_address=wallet_address)
         # When a new user is created, we need to mint them a Tummy NFT
         # First, choose a random base Tummy URI
         tummy_uri = random.choice(BASE_TUMMIES_URIS)
-        user.tummy_token_id = tummy_contract_instance.functions._tokenIds().call()
+        chain = await asyncio.to_thread(get_chain)
+        # Only a guess, another signup may get this ID first: the mint job corrects it
+        user.tummy_token_id = await asyncio.to_thread(
+            chain.tummy_contract_instance.functions._tokenIds().call
+        )
         user.profile_picture_url = f"https://ipfs.io/ipfs/{tummy_uri}.png"
-        user.save()
-        background_tasks.add_task(
-            mint_and_create_6551,
+        # The account address is deterministic, so it is known before the account is deployed
+        user.tummy_6551_account = tummy_6551_account(user.tummy_token_id)
+        user, job = await repository.create_user(
             user,
-            tummy_uri,
+            job_queue,
+            job_id("tummy", wallet_address),
+            "mint_and_create_6551",
+            {"wallet_address": wallet_address, "metadata_uri": tummy_uri},
         )
+        if job is None:
+            # A concurrent first login got there first and is taking care of the mint
+            return user
+        response.headers["Location"] = f"/jobs/{job.id}"
         return user
 
 
-def mint_and_create_6551(user: User, metadata_uri: str) -> None:
+def update_user(user: User, *fields: str) -> None:
+    # Writes only these fields: the API appends check-ins to the same document meanwhile
+    time_firestore(
+        "users.update",
+        user._get_doc_ref().update,
+        {field: getattr(user, field) for field in fields},
+    )
+
+
+def send_step(job: Job, step: str, contract_function) -> Future:
+    # A retried job picks up the transaction an earlier attempt sent for this step, and only
+    # sends a new one if there is none or it reverted or was dropped
+    tx_sender = get_chain().tx_sender
+    tx_hash = job.progress.get(step)
+    if tx_hash is not None:
+        future = tx_sender.resume(tx_hash)
+        if future is not None:
+            print(f"Job {job.id}: resuming {step} transaction {tx_hash}")
+            return future
+    future = tx_sender.send(contract_function)
+    job.progress[step] = future.tx_hash
+    time_firestore("jobs.save_progress", job_queue.save_progress, job)
+    return future
+
+
+def run_batch_step(
+    jobs: list[Job], step: str, build, errors: dict[str, Exception]
+) -> list[Job]:
+    """send_step for a batch of jobs sharing one transaction, waiting for the receipts.
+
+    Jobs whose earlier attempt's transaction can be resumed wait for it, the others
+    share one transaction made by `build` from them. Each job's arguments are checked
+    on their own first, and a batch that reverts is split in halves and sent again, so
+    only the offending jobs fail. Returns the jobs whose step succeeded, in order, and
+    records the others' errors in `errors`.
+    """
+    from tx_sender import TransactionReverted
+    from web3.exceptions import ContractLogicError
+
+    tx_sender = get_chain().tx_sender
+    futures: dict[str, Future] = {}
+    resumed: dict[str, Optional[Future]] = {}
+    unsent = []
+    for job in jobs:
+        tx_hash = job.progress.get(step)
+        if tx_hash is not None and tx_hash not in resumed:
+            resumed[tx_hash] = tx_sender.resume(tx_hash)
+        if tx_hash is not None and resumed[tx_hash] is not None:
+            futures[job.id] = resumed[tx_hash]
+            continue
+        try:
+            build([job])
+        except Exception as e:
+            errors[job.id] = e
+        else:
+            unsent.append(job)
+
+    def send(batch: list[Job]) -> list[Job]:
+        try:
+            future = tx_sender.send(build(batch))
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+        else:
+            for job in batch:
+                job.progress[step] = future.tx_hash
+                time_firestore("jobs.save_progress", job_queue.save_progress, job)
+        try:
+            future.result()
+        except (ContractLogicError, TransactionReverted) as e:
+            if len(batch) == 1:
+                errors[batch[0].id] = e
+                return []
+            print(f"{step} of {len(batch)} jobs reverted, splitting the batch")
+            half = len(batch) // 2
+            return send(batch[:half]) + send(batch[half:])
+        except Exception as e:
+            for job in batch:
+                errors[job.id] = e
+            return []
+        return batch
+
+    succeeded = {job.id for job in send(unsent)} if unsent else set()
+    for job_id_, future in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            errors[job_id_] = e
+        else:
+            succeeded.add(job_id_)
+    return [job for job in jobs if job.id in succeeded]
+
+
+def mint_and_create_6551(job: Job, user: User, metadata_uri: str) -> None:
     # When a new user is created, we need to mint them a Tummy NFT and then create an ERC-6551 for the NFT
-    nonce = w3.eth.get_transaction_count(os.environ["DEPLOYER_ADDRESS"])
-    tx = tummy_contract_instance.functions.mintNFT(
-        user.wallet_address,
-        metadata_uri,
-    ).build_transaction(
-        {
-            "chainId": 5,
-            "gas": 1000000,
-            "maxFeePerGas": w3.to_wei("20", "gwei"),
-            "maxPriorityFeePerGas": w3.to_wei("10", "gwei"),
-            "nonce": nonce,
-        }
+    # The account is created for the token ID the mint actually produced, so it waits for the mint
+    chain = get_chain()
+    mint_receipt = send_step(
+        job,
+        "mint",
+        chain.tummy_contract_instance.functions.mintNFT(
+            user.wallet_address,
+            metadata_uri,
+        ),
     )
-    signed_tx = w3.eth.account.sign_transaction(tx, private_key=private_key)
-    tx_hash = w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-    _ = w3.eth.wait_for_transaction_receipt(tx_hash)
-    print("Tummy NFT minted")
-    # Now we need to create an ERC-6551 for the NFT
-    nonce = w3.eth.get_transaction_count(os.environ["DEPLOYER_ADDRESS"])
-    tx = erc6551_registry_instance.functions.createAccount(
-        erc6551_account_instance.address,
-        5,
-        tummy_contract_instance.address,
-        user.tummy_token_id,
-        1,
-        "0x",
-    ).build_transaction(
-        {
-            "chainId": 5,
-            "gas": 1000000,
-            "maxFeePerGas": w3.to_wei("20", "gwei"),
-            "maxPriorityFeePerGas": w3.to_wei("10", "gwei"),
-            "nonce": nonce,
-        }
+    token_id = chain.minted_token_id(mint_receipt.result(), user.wallet_address)
+    print(f"Tummy NFT {token_id} minted")
+    if token_id != user.tummy_token_id:
+        print(f"Expected Tummy {user.tummy_token_id}, correcting {user.wallet_address}")
+        user.tummy_token_id = token_id
+        user.tummy_6551_account = tummy_6551_account(token_id)
+        update_user(user, "tummy_token_id", "tummy_6551_account")
+    create_receipt = send_step(
+        job,
+        "create_account",
+        chain.erc6551_registry_instance.functions.createAccount(
+            chain.erc6551_account_instance.address,
+            chain.chain_id,
+            chain.tummy_contract_instance.address,
+            token_id,
+            1,
+            "0x",
+        ),
     )
-    signed_tx = w3.eth.account.sign_transaction(tx, private_key=private_key)
-    tx_hash = w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-    _ = w3.eth.wait_for_transaction_receipt(tx_hash)
+    receipt = create_receipt.result()
     print("ERC-6551 created")
-    # Get the address of the ERC-6551 account
-    user.tummy_6551_account = erc6551_registry_instance.functions.account(
-        erc6551_account_instance.address,
-        5,
-        tummy_contract_instance.address,
-        user.tummy_token_id,
-        1,
-    ).call()
-    user.save()
-    print("ERC-6551 account address saved")
+    # Cross-check the locally computed address against the one the registry emitted
+    account_created = chain.erc6551_registry_instance.events.AccountCreated()
+    for event in account_created.process_receipt(receipt):
+        if event.args.tokenId != token_id:
+            continue
+        if event.args.account != user.tummy_6551_account:
+            print(
+                f"ERC-6551 account mismatch: computed {user.tummy_6551_account}, "
+                f"registry created {event.args.account}"
+            )
+            user.tummy_6551_account = event.args.account
+            update_user(user, "tummy_6551_account")
 
 
-def mint_proof_of_snack_and_transfer_to_6551_and_evolve(
-    user: User, restaurant_id: str
-) -> None:
-    # We mint a ProofOfSnack NFT and transfer it to the Tummy ERC-6551
-    nonce = w3.eth.get_transaction_count(os.environ["DEPLOYER_ADDRESS"])
-    # Get the POAP URI from the restaurant
-    print(f"Fetching restaurant {restaurant_id}")
-    restaurant = Restaurant.get_by_doc_id(restaurant_id)
-    metadata_uri = restaurant.poap_uri
-    tx = proof_of_snack_contract_instance.functions.mintNFT(
-        user.tummy_6551_account,
-        metadata_uri,
-    ).build_transaction(
-        {
-            "chainId": 5,
-            "gas": 1000000,
-            "maxFeePerGas": w3.to_wei("20", "gwei"),
-            "maxPriorityFeePerGas": w3.to_wei("10", "gwei"),
-            "nonce": nonce,
-        }
-    )
-    signed_tx = w3.eth.account.sign_transaction(tx, private_key=private_key)
-    tx_hash = w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-    _ = w3.eth.wait_for_transaction_receipt(tx_hash)
-    print("ProofOfSnack NFT minted")
+def evolved_metadata_uri(profile_picture_url: str) -> str:
     # We evolve the user's Tummy NFT, this is done by incrementing the IPFS URI by 1 and replacing it
     # We want to get Qmb6xm57jyCZk2VxmU3izsrQ6aW9KCtuangPmvcQwQrADD/10.png from https://ipfs.io/ipfs/Qmb6xm57jyCZk2VxmU3izsrQ6aW9KCtuangPmvcQwQrADD/10.png
-    metadata_uri = user.profile_picture_url.split("ipfs.io/ipfs/")[1].split(".png")[0]
+    metadata_uri = profile_picture_url.split("ipfs.io/ipfs/")[1].split(".png")[0]
     # Increment the last digit
     last_digit = metadata_uri[-1]
     new_last_digit = str(int(last_digit) + 1)
     metadata_uri = metadata_uri[:-1] + new_last_digit
     # Append .png
-    metadata_uri = "https://ipfs.io/ipfs/" + metadata_uri + ".png"
+    return "https://ipfs.io/ipfs/" + metadata_uri + ".png"
+
+
+def restaurant_poap_uri(restaurant: Restaurant) -> str:
+    # Most restaurants have no POAP, they are minted a ProofOfSnack with an empty URI
+    return restaurant.poap_uri or ""
+
+
+def mint_proof_of_snack_and_transfer_to_6551_and_evolve(
+    job: Job, user: User, restaurant_id: str
+) -> None:
+    # We mint a ProofOfSnack NFT and transfer it to the Tummy ERC-6551
+    # Get the POAP URI from the restaurant
+    print(f"Fetching restaurant {restaurant_id}")
+    restaurant = time_firestore(
+        "restaurants.get", Restaurant.get_by_doc_id, restaurant_id
+    )
+    chain = get_chain()
+    mint_receipt = send_step(
+        job,
+        "mint",
+        chain.proof_of_snack_contract_instance.functions.mintNFT(
+            user.tummy_6551_account,
+            restaurant_poap_uri(restaurant),
+        ),
+    )
+    # Kept with the job, a retry after the user was saved must not evolve the picture twice
+    metadata_uri = job.progress.setdefault(
+        "metadata_uri", evolved_metadata_uri(user.profile_picture_url)
+    )
     print(f"New metadata URI: {metadata_uri}")
-    nonce = w3.eth.get_transaction_count(os.environ["DEPLOYER_ADDRESS"])
-    tx = tummy_contract_instance.functions.updateMetadataURI(
-        user.tummy_token_id,
-        metadata_uri,
-    ).build_transaction(
-        {
-            "chainId": 5,
-            "gas": 1000000,
-            "maxFeePerGas": w3.to_wei("20", "gwei"),
-            "maxPriorityFeePerGas": w3.to_wei("10", "gwei"),
-            "nonce": nonce,
-        }
+    evolve_receipt = send_step(
+        job,
+        "evolve",
+        chain.tummy_contract_instance.functions.updateMetadataURI(
+            user.tummy_token_id,
+            metadata_uri,
+        ),
     )
-    signed_tx = w3.eth.account.sign_transaction(tx, private_key=private_key)
-    tx_hash = w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-    _ = w3.eth.wait_for_transaction_receipt(tx_hash)
+    mint_receipt.result()
+    print("ProofOfSnack NFT minted")
+    evolve_receipt.result()
     print("Tummy NFT evolved")
     user.profile_picture_url = metadata_uri
-    user.save()
+    update_user(user, "profile_picture_url")
+
+
+# Jobs are run by worker.py and only carry JSON arguments, so they reload the user themselves
+def run_mint_and_create_6551(job: Job, wallet_address: str, metadata_uri: str) -> None:
+    user = time_firestore("users.get", User.get, wallet_address)
+    if user.tummy_6551_account is None:
+        user.tummy_6551_account = tummy_6551_account(user.tummy_token_id)
+        update_user(user, "tummy_6551_account")
+    mint_and_create_6551(job, user, metadata_uri)
+
+
+def checkin_user(wallet_address: str) -> User:
+    user = time_firestore("users.get", User.get, wallet_address)
+    signup = time_firestore(
+        "jobs.get", job_queue.get, job_id("tummy", wallet_address)
+    )
+    if signup is not None and signup.status != "done":
+        # The Tummy can't be evolved before it is minted, fail so the job is retried later
+        raise RuntimeError(f"User {wallet_address} has no Tummy NFT yet")
+    if user.tummy_6551_account is None:
+        user.tummy_6551_account = tummy_6551_account(user.tummy_token_id)
+    return user
+
+
+def run_checkin(job: Job, wallet_address: str, restaurant_id: str) -> None:
+    user = checkin_user(wallet_address)
+    mint_proof_of_snack_and_transfer_to_6551_and_evolve(job, user, restaurant_id)
+
+
+def run_checkins(jobs: list[Job]) -> dict[str, Exception]:
+    # Same as run_checkin, but a whole batch of check-ins costs one batchMintNFT and one
+    # batchUpdateMetadataURI transaction. Returns the errors of the jobs that failed.
+    errors: dict[str, Exception] = {}
+    users: dict[str, User] = {}
+    ready = []
+    for job in jobs:
+        wallet_address = job.args["wallet_address"]
+        try:
+            if wallet_address not in users:
+                users[wallet_address] = checkin_user(wallet_address)
+        except Exception as e:
+            errors[job.id] = e
+        else:
+            ready.append(job)
+    restaurants = {
+        restaurant.id: restaurant
+        for restaurant in time_firestore(
+            "restaurants.get_many",
+            Restaurant.get_many,
+            [job.args["restaurant_id"] for job in ready],
+        )
+    }
+    for job in ready:
+        if job.args["restaurant_id"] not in restaurants:
+            errors[job.id] = ModelNotFoundError(
+                f"No restaurant {job.args['restaurant_id']}"
+            )
+    ready = [job for job in ready if job.id not in errors]
+    chain = get_chain()
+
+    def mint(batch: list[Job]):
+        return chain.proof_of_snack_contract_instance.functions.batchMintNFT(
+            [users[job.args["wallet_address"]].tummy_6551_account for job in batch],
+            [
+                restaurant_poap_uri(restaurants[job.args["restaurant_id"]])
+                for job in batch
+            ],
+        )
+
+    minted = run_batch_step(ready, "mint", mint, errors)
+    print(f"{len(minted)} ProofOfSnack NFTs minted")
+    # A user checking in twice in the same batch evolves twice, in order
+    for job in minted:
+        user = users[job.args["wallet_address"]]
+        user.profile_picture_url = job.progress.setdefault(
+            "metadata_uri", evolved_metadata_uri(user.profile_picture_url)
+        )
+
+    def evolve(batch: list[Job]):
+        # Each token only needs the URI of its owner's latest check-in in the batch
+        latest = {job.args["wallet_address"]: job for job in batch}
+        return chain.tummy_contract_instance.functions.batchUpdateMetadataURI(
+            [users[wallet_address].tummy_token_id for wallet_address in latest],
+            [job.progress["metadata_uri"] for job in latest.values()],
+        )
+
+    evolved = run_batch_step(minted, "evolve", evolve, errors)
+    print(f"{len(evolved)} Tummy NFTs evolved")
+    # The picture of each user's latest evolved check-in
+    latest = {job.args["wallet_address"]: job for job in evolved}
+    for wallet_address, job in latest.items():
+        user = users[wallet_address]
+        user.profile_picture_url = job.progress["metadata_uri"]
+        try:
+            update_user(user, "profile_picture_url")
+        except Exception as e:
+            for evolved_job in evolved:
+                if evolved_job.args["wallet_address"] == wallet_address:
+                    errors[evolved_job.id] = e
+    return errors
+
+
+JOB_HANDLERS = {
+    "mint_and_create_6551": run_mint_and_create_6551,
+    "checkin": run_checkin,
+}
+# Run by the worker with CHECKIN_BATCHING=1, needs contracts deployed with batch minting
+BATCH_JOB_HANDLERS = {"checkin": run_checkins}
+CHECKIN_BATCH_SIZE = int(os.environ.get("CHECKIN_BATCH_SIZE", 50))
 
 
 @app.post("/restaurants/{restaurant_id}/checkin")
-async def checkin(
-    restaurant_id: str, wallet_address: str, background_tasks: BackgroundTasks
-) -> None:
+async def checkin(restaurant_id: str, wallet_address: str, response: Response) -> None:
     # Ensure address is checksummed
-    wallet_address = w3.to_checksum_address(wallet_address)
-    user = User.find_one({"wallet_address": wallet_address})
-    user.visited_restaurants.append(restaurant_id)
-    user.save()
-    background_tasks.add_task(
-        mint_proof_of_snack_and_transfer_to_6551_and_evolve,
-        user,
-        restaurant_id,
+    wallet_address = to_checksum_address(wallet_address)
+    await repository.add_visited_restaurant(wallet_address, restaurant_id)
+    # The job mints the ProofOfSnack and also evolves the user's Tummy NFT, on every check-in
+    job = await repository.firestore_call(
+        "jobs.enqueue",
+        job_queue.enqueue,
+        job_id("checkin", wallet_address, restaurant_id, uuid.uuid4().hex),
+        "checkin",
+        {"wallet_address": wallet_address, "restaurant_id": restaurant_id},
     )
-    # We also need to evolve the user's Tummy NFT
+    response.headers["Location"] = f"/jobs/{job.id}"
 
     return 200
 
@@ -234,16 +571,25 @@ async def checkin(
 @app.get("/proof_of_snacks/{wallet_address}")
 async def get_proof_of_snacks(wallet_address: str) -> list[Restaurant]:
     # Ensure address is checksummed
-    wallet_address = w3.to_checksum_address(wallet_address)
-    user = User.find_one({"wallet_address": wallet_address})
-    restaurants = user.visited_restaurants
+    wallet_address = to_checksum_address(wallet_address)
+    user = await repository.get_user(wallet_address)
+    restaurants = await repository.get_restaurants_by_ids(user.visited_restaurants)
     # Filter only restaurants with POAPs
-    restaurants = [
-        Restaurant.get_by_doc_id(restaurant)
-        for restaurant in restaurants
-        if Restaurant.get_by_doc_id(restaurant).poap_uri != ""
-    ]
-    return restaurants
+    return [restaurant for restaurant in restaurants if restaurant.poap_uri]
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> Job:
+    job = await repository.firestore_call("jobs.get", job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/metrics")
+def metrics() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 
 @app.get("/.well-known/apple-app-site-association")
 def apple_app_site_association():
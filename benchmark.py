@@ -0,0 +1,416 @@
+# Load test for the API. Runs the app under gunicorn, as the Dockerfile does, against the
+# Firestore emulator and a local JSON-RPC chain stub, drives each scenario with concurrent
+# requests and reports latencies, then prints the Firestore, RPC and job metrics the run produced,
+# summed over the gunicorn workers. Cold start (import, startup and first request) is timed
+# before the scenarios. Compare runs with different --workers/--threads to size the Dockerfile's.
+#
+#   gcloud emulators firestore start --host-port=localhost:8080
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 python benchmark.py --requests 500 --concurrency 32
+import argparse
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import rlp
+from eth_abi import decode, encode
+from eth_account import Account
+from eth_utils import keccak
+
+ZERO_WORD = "0x" + "00" * 32
+TOKEN_IDS = keccak(text="_tokenIds()")[:4]
+# Argument types of the calls that mint, by selector
+MINTS = {
+    keccak(text="mintNFT(address,string)")[:4]: ("address", "string"),
+    keccak(text="batchMintNFT(address[],string[])")[:4]: ("address[]", "string[]"),
+}
+TRANSFER = keccak(text="Transfer(address,address,uint256)")
+# Paris, where the sample catalog is
+CENTER = (48.8566, 2.3522)
+
+
+class ChainStub(ThreadingHTTPServer):
+    """Just enough of a JSON-RPC node for the app: transactions are mined after `block_time`.
+
+    Mints emit Transfer events with token IDs counted per contract, as the NFT contracts do.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, block_time: float = 0.05) -> None:
+        super().__init__(("127.0.0.1", 0), ChainStubHandler)
+        self.block_time = block_time
+        self.started = time.monotonic()
+        self.nonces: dict[str, int] = {}
+        self.transactions: dict[str, tuple[float, list]] = {}
+        self.token_ids: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def block_number(self) -> int:
+        return int((time.monotonic() - self.started) / self.block_time) + 1
+
+    def handle_rpc(self, method: str, params: list):
+        if method == "eth_chainId":
+            return "0x5"
+        if method == "eth_blockNumber":
+            return hex(self.block_number())
+        if method == "eth_call":
+            call = params[0]
+            if bytes.fromhex(call["data"][2:]).startswith(TOKEN_IDS):
+                with self.lock:
+                    return "0x" + encode(
+                        ["uint256"], [self.token_ids.get(call["to"].lower(), 0)]
+                    ).hex()
+            return ZERO_WORD
+        if method == "eth_getCode":
+            return "0x"
+        if method == "eth_estimateGas":
+            return hex(100000)
+        if method == "eth_getTransactionCount":
+            with self.lock:
+                return hex(self.nonces.get(params[0].lower(), 0))
+        if method == "eth_sendRawTransaction":
+            raw = bytes.fromhex(params[0][2:])
+            tx_hash = "0x" + keccak(raw).hex()
+            sender = Account.recover_transaction(raw).lower()
+            with self.lock:
+                self.nonces[sender] = self.nonces.get(sender, 0) + 1
+                self.transactions[tx_hash] = (time.monotonic(), self.mint_logs(raw))
+            return tx_hash
+        if method == "eth_getTransactionReceipt":
+            with self.lock:
+                sent_at, logs = self.transactions.get(params[0], (None, []))
+            if sent_at is None or time.monotonic() - sent_at < self.block_time:
+                return None
+            return {
+                "blockHash": ZERO_WORD,
+                "blockNumber": hex(self.block_number()),
+                "contractAddress": None,
+                "cumulativeGasUsed": "0x5208",
+                "effectiveGasPrice": "0x1",
+                "from": "0x" + "00" * 20,
+                "gasUsed": "0x5208",
+                "logs": [
+                    {
+                        **log,
+                        "blockHash": ZERO_WORD,
+                        "blockNumber": hex(self.block_number()),
+                        "logIndex": hex(i),
+                        "removed": False,
+                        "transactionHash": params[0],
+                        "transactionIndex": "0x0",
+                    }
+                    for i, log in enumerate(logs)
+                ],
+                "logsBloom": "0x" + "00" * 256,
+                "status": "0x1",
+                "to": "0x" + "00" * 20,
+                "transactionHash": params[0],
+                "transactionIndex": "0x0",
+                "type": "0x2",
+            }
+        raise ValueError(f"Unsupported method {method}")
+
+    def mint_logs(self, raw: bytes) -> list:
+        # Fields of an EIP-1559 transaction: chain ID, nonce, tip, fee cap, gas, to, value, data
+        fields = rlp.decode(raw[1:])
+        to, data = "0x" + fields[5].hex(), fields[7]
+        if data[:4] not in MINTS:
+            return []
+        collectors, _ = decode(MINTS[data[:4]], data[4:])
+        if isinstance(collectors, str):
+            collectors = [collectors]
+        logs = []
+        for collector in collectors:
+            token_id = self.token_ids.get(to, 0)
+            self.token_ids[to] = token_id + 1
+            topics = [TRANSFER, bytes(32), encode(["address"], [collector])]
+            topics.append(encode(["uint256"], [token_id]))
+            logs.append(
+                {"address": to, "topics": ["0x" + t.hex() for t in topics], "data": "0x"}
+            )
+        return logs
+
+
+class ChainStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        try:
+            response = {"result": self.server.handle_rpc(request["method"], request["params"])}
+        except Exception as e:
+            response = {"error": {"code": -32000, "message": str(e)}}
+        body = json.dumps({"jsonrpc": "2.0", "id": request["id"], **response}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def configure_environment(chain: ChainStub) -> None:
+    deployer = Account.create()
+    os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "snacks-benchmark")
+    os.environ.update(
+        RPC_HTTP_URL=chain.url,
+        DEPLOYER_PRIVATE_KEY=deployer.key.hex(),
+        DEPLOYER_ADDRESS=deployer.address,
+        TUMMY_NFT_ADDRESS="0x" + "11" * 20,
+        PROOF_OF_SNACK_NFT_ADDRESS="0x" + "22" * 20,
+        ERC6551_REGISTRY_ADDRESS="0x" + "33" * 20,
+        ERC6551_ACCOUNT_ADDRESS="0x" + "44" * 20,
+        JOB_QUEUE_SQLITE_PATH=os.path.join(tempfile.mkdtemp(), "jobs.db"),
+        # Every process, the gunicorn workers and this one, writes its metrics here
+        PROMETHEUS_MULTIPROC_DIR=tempfile.mkdtemp(),
+    )
+
+
+def start_server(port: int, workers: int, threads: int) -> subprocess.Popen:
+    # The same command line as the Dockerfile's
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--workers",
+            str(workers),
+            "--worker-class",
+            "uvicorn.workers.UvicornWorker",
+            "--threads",
+            str(threads),
+            "--log-level",
+            "warning",
+            "app:app",
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+
+def wait_until_serving(base_url: str, server: subprocess.Popen) -> None:
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            request(base_url, "GET", "/.well-known/apple-app-site-association")
+            return
+        except (urllib.error.URLError, OSError):
+            if server.poll() is not None or time.monotonic() > deadline:
+                sys.exit("gunicorn failed to start")
+            time.sleep(0.05)
+
+
+def collect_metrics():
+    from prometheus_client import CollectorRegistry
+    from prometheus_client.multiprocess import MultiProcessCollector
+
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry, os.environ["PROMETHEUS_MULTIPROC_DIR"])
+    return registry
+
+
+def request(base_url: str, method: str, path: str) -> bytes:
+    with urllib.request.urlopen(
+        urllib.request.Request(base_url + path, method=method), timeout=60
+    ) as response:
+        return response.read()
+
+
+def run_scenario(base_url: str, name: str, make_request, requests: int, concurrency: int):
+    latencies = []
+    errors = []
+
+    def one(_) -> None:
+        method, path = make_request()
+        started = time.perf_counter()
+        try:
+            request(base_url, method, path)
+        except (urllib.error.URLError, OSError) as e:
+            errors.append(e)
+            return
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    if len(latencies) >= 2:
+        quantiles = statistics.quantiles(latencies, n=100)
+        p50, p95, p99 = (quantiles[i - 1] * 1000 for i in (50, 95, 99))
+    else:
+        p50 = p95 = p99 = float("nan")
+    print(
+        f"{name:<36} {requests / elapsed:>8.1f} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {len(errors):>7}"
+    )
+
+
+def print_startup(
+    import_seconds: float,
+    serving_seconds: float,
+    first_request_seconds: float,
+    registry,
+) -> None:
+    print(f"{'import app':<36} {import_seconds * 1000:>8.1f} ms")
+    print(f"{'gunicorn start to serving':<36} {serving_seconds * 1000:>8.1f} ms")
+    # One sample per process, the slowest is what a cold start waits for
+    for phase in ("lifespan", "chain"):
+        values = [
+            sample.value
+            for metric in registry.collect()
+            for sample in metric.samples
+            if sample.name == "snacks_startup_seconds"
+            and sample.labels.get("phase") == phase
+        ]
+        if values:
+            print(f"{'startup ' + phase:<36} {max(values) * 1000:>8.1f} ms")
+    print(f"{'first GET /restaurants':<36} {first_request_seconds * 1000:>8.1f} ms\n")
+
+
+def print_metrics(registry) -> None:
+    print("\nBackend calls")
+    for metric in registry.collect():
+        if metric.name not in (
+            "snacks_firestore_call_seconds",
+            "snacks_rpc_call_seconds",
+            "snacks_job_seconds",
+        ):
+            continue
+        for sample in metric.samples:
+            if sample.name.endswith("_count"):
+                labels = ",".join(sample.labels.values())
+                total = next(
+                    s.value
+                    for s in metric.samples
+                    if s.name.endswith("_sum") and s.labels == sample.labels
+                )
+                print(
+                    f"{metric.name:<32} {labels:<36} {int(sample.value):>7} calls "
+                    f"{total / max(sample.value, 1) * 1000:>8.1f} ms avg"
+                )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the API against local stubs")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads")
+    parser.add_argument("--worker-threads", type=int, default=8, help="Job worker threads")
+    parser.add_argument("--block-time", type=float, default=0.05)
+    args = parser.parse_args()
+
+    if "FIRESTORE_EMULATOR_HOST" not in os.environ:
+        sys.exit("Set FIRESTORE_EMULATOR_HOST, the benchmark must not run against production")
+
+    chain = ChainStub(block_time=args.block_time)
+    threading.Thread(target=chain.serve_forever, daemon=True).start()
+    configure_environment(chain)
+
+    import upload
+
+    upload.upload("restaurant_data.csv")
+
+    from jobs import run_worker
+
+    # The job worker runs in this process, and times the import of the app for it
+    started = time.perf_counter()
+    import app
+
+    import_seconds = time.perf_counter() - started
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = start_server(port, args.workers, args.threads)
+    wait_until_serving(base_url, server)
+    serving_seconds = time.perf_counter() - started
+    threading.Thread(
+        target=run_worker,
+        args=(app.job_queue, app.JOB_HANDLERS, args.worker_threads),
+        kwargs={
+            "poll_interval": 0.05,
+            "batch_handlers": app.BATCH_JOB_HANDLERS
+            if os.environ.get("CHECKIN_BATCHING") == "1"
+            else None,
+            "batch_size": app.CHECKIN_BATCH_SIZE,
+        },
+        daemon=True,
+    ).start()
+
+    started = time.perf_counter()
+    restaurant_ids = [r["id"] for r in json.loads(request(base_url, "GET", "/restaurants"))]
+    print_startup(
+        import_seconds, serving_seconds, time.perf_counter() - started, collect_metrics()
+    )
+    users = [Account.create().address for _ in range(args.requests)]
+    signups = iter(users)
+
+    def nearby():
+        lat = CENTER[0] + random.uniform(-0.03, 0.03)
+        lon = CENTER[1] + random.uniform(-0.03, 0.03)
+        return "GET", f"/restaurants/nearby?lat={lat}&lon={lon}&radius=1000"
+
+    scenarios = [
+        ("GET /restaurants", lambda: ("GET", "/restaurants")),
+        (
+            "GET /restaurants/{id}",
+            lambda: ("GET", f"/restaurants/{random.choice(restaurant_ids)}"),
+        ),
+        ("GET /restaurants/nearby", nearby),
+        ("GET /users/{wallet} (signup)", lambda: ("GET", f"/users/{next(signups)}")),
+        ("GET /users/{wallet}", lambda: ("GET", f"/users/{random.choice(users)}")),
+        (
+            "POST /restaurants/{id}/checkin",
+            lambda: (
+                "POST",
+                f"/restaurants/{random.choice(restaurant_ids)}/checkin"
+                f"?wallet_address={random.choice(users)}",
+            ),
+        ),
+        (
+            "GET /proof_of_snacks/{wallet}",
+            lambda: ("GET", f"/proof_of_snacks/{random.choice(users)}"),
+        ),
+        (
+            "GET /restaurants/{id}/reviews",
+            lambda: ("GET", f"/restaurants/{random.choice(restaurant_ids)}/reviews"),
+        ),
+    ]
+    print(f"{'scenario':<36} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, make_request in scenarios:
+        run_scenario(base_url, name, make_request, args.requests, args.concurrency)
+
+    # Let the worker drain what the scenarios queued so job durations are included
+    deadline = time.monotonic() + 120
+    while app.job_queue.depth() and time.monotonic() < deadline:
+        time.sleep(0.5)
+    print_metrics(collect_metrics())
+    server.terminate()
+    server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+from typing import Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from web3 import Web3
+from web3.constants import ADDRESS_ZERO
+from web3.logs import DISCARD
+from web3.middleware import simple_cache_middleware
+from web3.types import RPCEndpoint, RPCResponse
+
+from abi import (
+    erc6551_account_abi,
+    erc6551_registry_abi,
+    parse_abi,
+    tummy_abi,
+    tummy_batch_abi,
+)
+from metrics import RPC_SECONDS, STARTUP_SECONDS
+from tx_sender import TransactionSender
+
+CHAIN_ID = 5
+
+
+class PooledHTTPProvider(Web3.HTTPProvider):
+    """HTTPProvider sharing one keep-alive connection pool between all threads.
+
+    The stock provider keeps a session per thread, so every request and worker
+    thread opens its own connections to the RPC node.
+    """
+
+    def __init__(self, endpoint_uri: str, pool_size: int = 32, timeout: float = 10):
+        super().__init__(endpoint_uri, request_kwargs={"timeout": timeout})
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            # Only retry failed connects: a request that reached the node may have been a
+            # transaction broadcast, and replaying it is not safe
+            max_retries=Retry(
+                total=3, connect=3, read=0, status=0, backoff_factor=0.2
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        with RPC_SECONDS.labels(method).time():
+            response = self.session.post(
+                self.endpoint_uri,
+                data=self.encode_rpc_request(method, params),
+                **dict(self.get_request_kwargs()),
+            )
+        response.raise_for_status()
+        return self.decode_rpc_response(response.content)
+
+
+def make_web3(endpoint_uri: str, pool_size: int = 32) -> Web3:
+    w3 = Web3(PooledHTTPProvider(endpoint_uri, pool_size=pool_size))
+    # Caches eth_chainId and other constant results, web3 validates every call against the chain ID
+    w3.middleware_onion.add(simple_cache_middleware, name="simple_cache")
+    return w3
+
+
+class Chain:
+    """Web3 provider, contracts and transaction sender, configured from the environment."""
+
+    def __init__(self) -> None:
+        self.w3 = make_web3(
+            os.environ["RPC_HTTP_URL"],
+            pool_size=int(os.environ.get("RPC_POOL_SIZE", 32)),
+        )
+        # The batch entry points are only present on contracts deployed with batch minting
+        tummy_with_batch_abi = parse_abi(tummy_abi) + parse_abi(tummy_batch_abi)
+        self.tummy_contract_instance = self.w3.eth.contract(
+            address=os.environ["TUMMY_NFT_ADDRESS"], abi=tummy_with_batch_abi
+        )
+        self.proof_of_snack_contract_instance = self.w3.eth.contract(
+            address=os.environ["PROOF_OF_SNACK_NFT_ADDRESS"], abi=tummy_with_batch_abi
+        )
+        self.erc6551_registry_instance = self.w3.eth.contract(
+            address=os.environ["ERC6551_REGISTRY_ADDRESS"],
+            abi=parse_abi(erc6551_registry_abi),
+        )
+        self.erc6551_account_instance = self.w3.eth.contract(
+            address=os.environ["ERC6551_ACCOUNT_ADDRESS"],
+            abi=parse_abi(erc6551_account_abi),
+        )
+        self.chain_id = CHAIN_ID
+        self.tx_sender = TransactionSender(
+            self.w3,
+            os.environ["DEPLOYER_ADDRESS"],
+            os.environ["DEPLOYER_PRIVATE_KEY"],
+            chain_id=self.chain_id,
+        )
+
+    def minted_token_id(self, receipt, to: str) -> int:
+        """ID of the Tummy minted to `to` by the transaction with this receipt."""
+        tummy = self.tummy_contract_instance
+        for event in tummy.events.Transfer().process_receipt(receipt, errors=DISCARD):
+            if (
+                event.address == tummy.address
+                and event.args["from"] == ADDRESS_ZERO
+                and event.args.to == to
+            ):
+                return event.args.tokenId
+        raise ValueError(f"No Tummy minted to {to} in {receipt['transactionHash'].hex()}")
+
+
+_chain: Optional[Chain] = None
+_chain_lock = threading.Lock()
+
+
+def get_chain() -> Chain:
+    """Returns the process-wide Chain, building it on first use.
+
+    Routes that never touch the chain don't pay for building it, and don't need
+    the chain environment variables to be set.
+    """
+    global _chain
+    if _chain is None:
+        with _chain_lock:
+            if _chain is None:
+                started = time.perf_counter()
+                _chain = Chain()
+                STARTUP_SECONDS.labels("chain").set(time.perf_counter() - started)
+    return _chain
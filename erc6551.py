@@ -0,0 +1,46 @@
+from eth_abi import encode
+from eth_utils import keccak, to_bytes, to_checksum_address
+
+# ERC6551BytecodeLib (registry v0.2): an ERC-1167 minimal proxy to the implementation
+# followed by the ABI-encoded (salt, chainId, tokenContract, tokenId) footer
+PROXY_PREFIX = bytes.fromhex("3d60ad80600a3d3981f3363d3d373d3d3d363d73")
+PROXY_SUFFIX = bytes.fromhex("5af43d82803e903d91602b57fd5bf3")
+
+
+def create2_address(deployer: str, salt: bytes, init_code: bytes) -> str:
+    digest = keccak(b"\xff" + to_bytes(hexstr=deployer) + salt + keccak(init_code))
+    return to_checksum_address(digest[12:])
+
+
+def account_creation_code(
+    implementation: str, chain_id: int, token_contract: str, token_id: int, salt: int
+) -> bytes:
+    return (
+        PROXY_PREFIX
+        + to_bytes(hexstr=implementation)
+        + PROXY_SUFFIX
+        + encode(
+            ["uint256", "uint256", "address", "uint256"],
+            [salt, chain_id, token_contract, token_id],
+        )
+    )
+
+
+def account_address(
+    registry: str,
+    implementation: str,
+    chain_id: int,
+    token_contract: str,
+    token_id: int,
+    salt: int,
+) -> str:
+    """Computes what the registry's `account(...)` view returns, without an RPC call.
+
+    The address is known before `createAccount` has been sent, since it only
+    depends on the arguments.
+    """
+    return create2_address(
+        registry,
+        salt.to_bytes(32, "big"),
+        account_creation_code(implementation, chain_id, token_contract, token_id, salt),
+    )
@@ -0,0 +1,402 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Collection, Optional
+
+from firedantic import CONFIGURATIONS, ModelNotFoundError
+from google.api_core.exceptions import AlreadyExists
+from google.cloud.firestore import transactional
+
+from metrics import JOB_QUEUE_DEPTH, JOB_SECONDS, time_firestore
+from models import Job
+
+# How long a worker may hold a job before another worker is allowed to take it over
+LEASE_SECONDS = 600
+RETRY_BASE_DELAY = 5
+
+
+def job_id(*parts: str) -> str:
+    # Job IDs double as idempotency keys and Firestore document IDs, which cannot contain "/"
+    return "-".join(str(part).replace("/", "_") for part in parts)
+
+
+def _retry_delay(attempts: int) -> float:
+    return RETRY_BASE_DELAY * 2 ** (attempts - 1)
+
+
+class FirestoreJobQueue:
+    def enqueue(self, id_: str, kind: str, args: dict) -> Job:
+        """Queues a job unless one with the same ID already exists."""
+        job = Job(id=id_, kind=kind, args=args, updated_at=time.time())
+        data = job.dict(exclude={"id"})
+        try:
+            Job._get_col_ref().document(id_).create(data)
+        except AlreadyExists:
+            return Job.get_by_doc_id(id_)
+        return job
+
+    def create_and_enqueue(
+        self, doc_ref, data: dict, id_: str, kind: str, args: dict
+    ) -> Job:
+        """Creates a document and queues a job for it in one atomic write.
+
+        :raise google.api_core.exceptions.AlreadyExists: If the document or the job already exists.
+        """
+        job = Job(id=id_, kind=kind, args=args, updated_at=time.time())
+        batch = CONFIGURATIONS["db"].batch()
+        batch.create(doc_ref, data)
+        batch.create(Job._get_col_ref().document(id_), job.dict(exclude={"id"}))
+        batch.commit()
+        return job
+
+    def depth(self) -> int:
+        """Number of jobs waiting to run."""
+        result = Job._get_col_ref().where("status", "==", "queued").count().get()
+        return result[0][0].value
+
+    def get(self, id_: str) -> Optional[Job]:
+        try:
+            return Job.get_by_doc_id(id_)
+        except ModelNotFoundError:
+            return None
+
+    def claim(self, kinds: Optional[Collection[str]] = None) -> Optional[Job]:
+        """Claims a runnable job, only one of `kinds` if given."""
+        jobs = self.claim_many(1, kinds)
+        return jobs[0] if jobs else None
+
+    def claim_many(
+        self, limit: int, kinds: Optional[Collection[str]] = None
+    ) -> list[Job]:
+        """Claims up to `limit` runnable jobs, only of `kinds` if given."""
+        now = time.time()
+        if kinds is not None and not kinds:
+            return []
+        jobs = []
+        # Jobs whose worker died first, so a steady stream of new jobs can't starve them
+        for status, time_field in (
+            ("running", "lease_expires"),
+            ("queued", "run_after"),
+        ):
+            if len(jobs) == limit:
+                break
+            for snapshot in self._runnable(
+                status, time_field, now, limit - len(jobs), kinds
+            ):
+                job = self._claim(snapshot.id, now)
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+
+    def _runnable(
+        self,
+        status: str,
+        time_field: str,
+        now: float,
+        limit: int,
+        kinds: Optional[Collection[str]],
+    ):
+        # Served by the composite indexes on jobs in firestore.indexes.json
+        query = Job._get_col_ref().where("status", "==", status)
+        if kinds is not None:
+            query = query.where("kind", "in", list(kinds))
+        return (
+            query.where(time_field, "<", now)
+            .order_by(time_field)
+            .limit(limit)
+            .stream()
+        )
+
+    def _claim(self, id_: str, now: float) -> Optional[Job]:
+        doc_ref = Job._get_col_ref().document(id_)
+
+        @transactional
+        def claim(transaction) -> Optional[dict]:
+            data = doc_ref.get(transaction=transaction).to_dict()
+            if data is None or not _claimable(data, now):
+                return None
+            data.update(
+                status="running",
+                attempts=data["attempts"] + 1,
+                lease_expires=now + LEASE_SECONDS,
+                updated_at=now,
+            )
+            transaction.set(doc_ref, data)
+            return data
+
+        data = claim(CONFIGURATIONS["db"].transaction())
+        return None if data is None else Job(id=id_, **data)
+
+    def complete(self, job: Job) -> None:
+        job.status = "done"
+        job.error = None
+        job.updated_at = time.time()
+        job.save()
+
+    def fail(self, job: Job, error: str) -> None:
+        _record_failure(job, error)
+        job.save()
+
+    def save_progress(self, job: Job) -> None:
+        job.updated_at = time.time()
+        Job._get_col_ref().document(job.id).update(
+            {"progress": job.progress, "updated_at": job.updated_at}
+        )
+
+
+class SQLiteJobQueue:
+    """Same interface as FirestoreJobQueue, for local runs without Firestore."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    run_after REAL NOT NULL,
+                    lease_expires REAL NOT NULL
+                )
+                """
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        if not hasattr(self._local, "conn"):
+            self._local.conn = sqlite3.connect(self.path, timeout=30)
+        return self._local.conn
+
+    def _write(self, conn: sqlite3.Connection, job: Job) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?)",
+            (
+                job.id,
+                job.json(exclude={"id"}),
+                job.status,
+                job.run_after,
+                job.lease_expires,
+            ),
+        )
+
+    def enqueue(self, id_: str, kind: str, args: dict) -> Job:
+        """Queues a job unless one with the same ID already exists."""
+        job = Job(id=id_, kind=kind, args=args, updated_at=time.time())
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            existing = self.get(id_)
+            if existing is not None:
+                return existing
+            self._write(conn, job)
+        return job
+
+    def create_and_enqueue(
+        self, doc_ref, data: dict, id_: str, kind: str, args: dict
+    ) -> Job:
+        """Same as FirestoreJobQueue.create_and_enqueue, but not atomic.
+
+        The job is queued first: if the create fails, the job is retried until the
+        document exists, and a document is never left without its job.
+        """
+        job = self.enqueue(id_, kind, args)
+        doc_ref.create(data)
+        return job
+
+    def depth(self) -> int:
+        """Number of jobs waiting to run."""
+        row = (
+            self._connection()
+            .execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'")
+            .fetchone()
+        )
+        return row[0]
+
+    def get(self, id_: str) -> Optional[Job]:
+        row = (
+            self._connection()
+            .execute("SELECT data FROM jobs WHERE id = ?", (id_,))
+            .fetchone()
+        )
+        return None if row is None else Job(id=id_, **json.loads(row[0]))
+
+    def claim(self, kinds: Optional[Collection[str]] = None) -> Optional[Job]:
+        """Claims a runnable job, only one of `kinds` if given."""
+        jobs = self.claim_many(1, kinds)
+        return jobs[0] if jobs else None
+
+    def claim_many(
+        self, limit: int, kinds: Optional[Collection[str]] = None
+    ) -> list[Job]:
+        """Claims up to `limit` runnable jobs, only of `kinds` if given."""
+        now = time.time()
+        kind_filter = ""
+        params = [now, now]
+        if kinds is not None:
+            if not kinds:
+                return []
+            placeholders = ", ".join("?" * len(kinds))
+            kind_filter = f"AND json_extract(data, '$.kind') IN ({placeholders})"
+            params += list(kinds)
+        jobs = []
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                f"""
+                SELECT id, data FROM jobs
+                WHERE ((status = 'queued' AND run_after <= ?)
+                   OR (status = 'running' AND lease_expires < ?))
+                   {kind_filter}
+                ORDER BY run_after LIMIT ?
+                """,
+                (*params, limit),
+            ).fetchall()
+            for id_, data in rows:
+                job = Job(id=id_, **json.loads(data))
+                job.status = "running"
+                job.attempts += 1
+                job.lease_expires = now + LEASE_SECONDS
+                job.updated_at = now
+                self._write(conn, job)
+                jobs.append(job)
+        return jobs
+
+    def complete(self, job: Job) -> None:
+        job.status = "done"
+        job.error = None
+        job.updated_at = time.time()
+        with self._connection() as conn:
+            self._write(conn, job)
+
+    def fail(self, job: Job, error: str) -> None:
+        _record_failure(job, error)
+        with self._connection() as conn:
+            self._write(conn, job)
+
+    def save_progress(self, job: Job) -> None:
+        job.updated_at = time.time()
+        with self._connection() as conn:
+            self._write(conn, job)
+
+
+def _claimable(data: dict, now: float) -> bool:
+    if data["status"] == "queued":
+        return data["run_after"] <= now
+    return data["status"] == "running" and data["lease_expires"] < now
+
+
+def _record_failure(job: Job, error: str) -> None:
+    now = time.time()
+    job.error = error
+    job.updated_at = now
+    if job.attempts >= job.max_attempts:
+        job.status = "failed"
+    else:
+        job.status = "queued"
+        job.run_after = now + _retry_delay(job.attempts)
+
+
+def get_job_queue():
+    # JOB_QUEUE_SQLITE_PATH switches to a local SQLite file, e.g. for development
+    path = os.environ.get("JOB_QUEUE_SQLITE_PATH")
+    if path:
+        return SQLiteJobQueue(path)
+    return FirestoreJobQueue()
+
+
+def track_queue_depth(queue) -> None:
+    """Reports the queue's depth through the JOB_QUEUE_DEPTH gauge, read at scrape time."""
+
+    def depth() -> float:
+        try:
+            return queue.depth()
+        except Exception:
+            return float("nan")
+
+    JOB_QUEUE_DEPTH.set_function(depth)
+
+
+def run_worker(
+    queue,
+    handlers: dict[str, Callable[..., None]],
+    threads: int = 8,
+    poll_interval: float = 1.0,
+    batch_handlers: Optional[
+        dict[str, Callable[[list[Job]], dict[str, Exception]]]
+    ] = None,
+    batch_size: int = 50,
+    stop: Optional[threading.Event] = None,
+) -> None:
+    """Runs `threads` loops that claim and execute jobs until `stop`, if given, is set.
+
+    Handlers are called with the job followed by its args. Kinds in `batch_handlers`
+    get a loop of their own instead, which claims up to `batch_size` of them at a time
+    and passes them to the batch handler together. The batch handler returns the
+    error of each job that failed, by job ID.
+    """
+    batch_handlers = batch_handlers or {}
+    stop = stop or threading.Event()
+    kinds = [kind for kind in handlers if kind not in batch_handlers]
+
+    def finish(job: Job, error: Optional[Exception], started: float) -> None:
+        outcome = "done" if error is None else "failed"
+        JOB_SECONDS.labels(job.kind, outcome).observe(time.monotonic() - started)
+        try:
+            if error is None:
+                time_firestore("jobs.complete", queue.complete, job)
+                print(f"Job {job.id} done")
+            else:
+                print(f"Job {job.id} failed: {error!r}")
+                time_firestore("jobs.fail", queue.fail, job, repr(error))
+        except Exception as e:
+            # The lease runs out and the job is retried
+            print(f"Failed to record the outcome of job {job.id}: {e!r}")
+
+    def loop() -> None:
+        while not stop.is_set():
+            try:
+                job = time_firestore("jobs.claim", queue.claim, kinds)
+            except Exception as e:
+                print(f"Failed to claim job: {e}")
+                job = None
+            if job is None:
+                stop.wait(poll_interval)
+                continue
+            print(f"Running job {job.id} (attempt {job.attempts})")
+            started = time.monotonic()
+            try:
+                handlers[job.kind](job, **job.args)
+            except Exception as e:
+                finish(job, e, started)
+            else:
+                finish(job, None, started)
+
+    def batch_loop(kind: str) -> None:
+        while not stop.is_set():
+            try:
+                jobs = time_firestore(
+                    "jobs.claim", queue.claim_many, batch_size, [kind]
+                )
+            except Exception as e:
+                print(f"Failed to claim {kind} jobs: {e}")
+                jobs = []
+            if not jobs:
+                stop.wait(poll_interval)
+                continue
+            print(f"Running {len(jobs)} {kind} jobs as a batch")
+            started = time.monotonic()
+            try:
+                errors = batch_handlers[kind](jobs)
+            except Exception as e:
+                errors = {job.id: e for job in jobs}
+            for job in jobs:
+                finish(job, errors.get(job.id), started)
+
+    with ThreadPoolExecutor(max_workers=threads + len(batch_handlers)) as executor:
+        for _ in range(threads):
+            executor.submit(loop)
+        for kind in batch_handlers:
+            executor.submit(batch_loop, kind)
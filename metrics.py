@@ -0,0 +1,38 @@
+from prometheus_client import Gauge, Histogram
+
+REQUEST_SECONDS = Histogram(
+    "snacks_http_request_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status"],
+)
+FIRESTORE_SECONDS = Histogram(
+    "snacks_firestore_call_seconds",
+    "Firestore call latency by operation",
+    ["operation"],
+)
+RPC_SECONDS = Histogram(
+    "snacks_rpc_call_seconds",
+    "JSON-RPC call latency by method",
+    ["method"],
+)
+JOB_SECONDS = Histogram(
+    "snacks_job_seconds",
+    "Background job duration by kind and outcome",
+    ["kind", "outcome"],
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+JOB_QUEUE_DEPTH = Gauge(
+    "snacks_job_queue_depth",
+    "Jobs waiting to be run",
+)
+STARTUP_SECONDS = Gauge(
+    "snacks_startup_seconds",
+    "Time spent in each startup phase of this process",
+    ["phase"],
+)
+
+
+def time_firestore(operation: str, fn, *args, **kwargs):
+    """Calls `fn`, which goes to Firestore, timed under `operation`."""
+    with FIRESTORE_SECONDS.labels(operation).time():
+        return fn(*args, **kwargs)
@@ -0,0 +1,43 @@
+# Moves reviews embedded in restaurant and user documents into the reviews collection.
+# Safe to re-run: review IDs are derived from their position and migrated documents lose
+# their embedded reviews field.
+from google.cloud.firestore import DELETE_FIELD, Client
+from firedantic import configure
+
+from models import Restaurant, Review, User
+
+client = Client()
+
+configure(client, prefix="snacks-")
+
+migrated = 0
+for doc in Restaurant._get_col_ref().stream():
+    reviews = doc.to_dict().get("reviews")
+    if reviews is None:
+        continue
+    batch = client.batch()
+    for i, review in enumerate(reviews):
+        review_ref = Review._get_col_ref().document(f"{doc.id}-{i}")
+        batch.set(review_ref, Review(**review).dict(exclude={"id"}))
+        # Firestore batches are capped at 500 writes
+        if i % 499 == 498:
+            batch.commit()
+            batch = client.batch()
+    batch.update(
+        doc.reference,
+        {
+            "reviews": DELETE_FIELD,
+            "rating_count": len(reviews),
+            "rating_sum": sum(review["rating"] for review in reviews),
+        },
+    )
+    batch.commit()
+    migrated += len(reviews)
+    print(f"Migrated {len(reviews)} reviews of restaurant {doc.id}")
+
+# Users only held copies of the restaurant reviews
+for doc in User._get_col_ref().stream():
+    if "reviews" in doc.to_dict():
+        doc.reference.update({"reviews": DELETE_FIELD})
+
+print(f"Migrated {migrated} reviews")
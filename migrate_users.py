@@ -0,0 +1,31 @@
+# Re-keys user documents by their checksummed wallet address. Safe to re-run: users that
+# are already keyed by address are left alone.
+from eth_utils import to_checksum_address
+from google.cloud.firestore import Client
+from firedantic import configure
+
+from models import User
+
+client = Client()
+
+configure(client, prefix="snacks-")
+
+migrated = 0
+for doc in User._get_col_ref().stream():
+    data = doc.to_dict()
+    wallet_address = to_checksum_address(data["wallet_address"])
+    if doc.id == wallet_address:
+        continue
+    target = User._get_col_ref().document(wallet_address)
+    if target.get().exists:
+        # Most likely a duplicate left by concurrent first logins, needs a human to merge
+        print(f"Skipping {doc.id}: user {wallet_address} already exists")
+        continue
+    batch = client.batch()
+    batch.create(target, {**data, "wallet_address": wallet_address})
+    batch.delete(doc.reference)
+    batch.commit()
+    migrated += 1
+    print(f"Moved user {doc.id} to {wallet_address}")
+
+print(f"Migrated {migrated} users")
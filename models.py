@@ -1,6 +1,7 @@
 from typing import Optional
-from pydantic import BaseModel
-from firedantic import Model
+from pydantic import BaseModel, root_validator
+from firedantic import CONFIGURATIONS, InvalidDocumentID, Model, ModelNotFoundError
+from google.cloud.firestore import Query, transactional
 
 RestaurantID = str
 
@@ -17,11 +18,71 @@ class Reservation(BaseModel):
     party_size: int
 
 
-class Review(BaseModel):
+class InvalidCursor(ValueError):
+    """A page was requested after something other than an item of the list."""
+
+
+class Review(Model):
+    __collection__ = "reviews"
     wallet_address: str
     restaurant_id: str
     rating: float
     text: str
+    created_at: float = 0
+
+    def create(self) -> None:
+        """Stores a new review and adds its rating to the restaurant's aggregate atomically."""
+        review_ref = self._get_col_ref().document()
+        restaurant_ref = Restaurant._get_col_ref().document(self.restaurant_id)
+
+        @transactional
+        def create(transaction) -> None:
+            restaurant = restaurant_ref.get(transaction=transaction).to_dict()
+            if restaurant is None:
+                raise ModelNotFoundError(
+                    f"No 'Restaurant' found with id '{self.restaurant_id}'"
+                )
+            transaction.create(review_ref, self.dict(exclude={"id"}))
+            transaction.update(
+                restaurant_ref,
+                {
+                    "rating_count": restaurant.get("rating_count", 0) + 1,
+                    "rating_sum": restaurant.get("rating_sum", 0) + self.rating,
+                },
+            )
+
+        create(CONFIGURATIONS["db"].transaction())
+        self.id = review_ref.id
+
+    @classmethod
+    def page(
+        cls, field: str, value: str, limit: int = 20, cursor: Optional[str] = None
+    ) -> tuple[list["Review"], Optional[str]]:
+        """Returns the newest reviews where `field == value`, starting after the review `cursor`.
+
+        The second element is the cursor for the next page, or None on the last page.
+
+        :raise InvalidCursor: If `cursor` isn't a review of this list.
+        """
+        query = (
+            cls._get_col_ref()
+            .where(field, "==", value)
+            .order_by("created_at", direction=Query.DESCENDING)
+        )
+        if cursor:
+            try:
+                cls._validate_document_id(cursor)
+            except InvalidDocumentID as e:
+                raise InvalidCursor(str(e))
+            snapshot = cls._get_col_ref().document(cursor).get()
+            # Restarting from the first page instead would let a client page forever
+            if not snapshot.exists or snapshot.get(field) != value:
+                raise InvalidCursor(f"No review {cursor} in this list")
+            query = query.start_after(snapshot)
+        docs = list(query.limit(limit + 1).stream())
+        reviews = [cls(**doc.to_dict(), id=doc.id) for doc in docs[:limit]]
+        next_cursor = reviews[-1].id if len(docs) > limit else None
+        return reviews, next_cursor
 
 
 class Restaurant(Model):
@@ -32,16 +93,77 @@ class Restaurant(Model):
     cuisine: str
     address: str
     geolocation: Geolocation
-    reviews: list[Review] = []
     poap_uri: Optional[str] = None
+    # Running totals over the reviews collection, kept up to date by Review.create
+    rating_count: int = 0
+    rating_sum: float = 0
+
+    @classmethod
+    def get_many(cls, doc_ids: list[str]) -> list["Restaurant"]:
+        """Fetches several restaurants in one batched read.
+
+        Duplicate IDs are fetched once, results follow the order of `doc_ids` and
+        IDs with no matching document are skipped.
+        """
+        doc_ids = list(dict.fromkeys(doc_ids))
+        col_ref = cls._get_col_ref()
+        refs = []
+        for doc_id in doc_ids:
+            try:
+                cls._validate_document_id(doc_id)
+            except InvalidDocumentID:
+                continue
+            refs.append(col_ref.document(doc_id))
+        if not refs:
+            return []
+        snapshots = {
+            snapshot.id: snapshot.to_dict()
+            for snapshot in CONFIGURATIONS["db"].get_all(refs)
+            if snapshot.exists
+        }
+        return [
+            cls(**snapshots[doc_id], id=doc_id)
+            for doc_id in doc_ids
+            if doc_id in snapshots
+        ]
 
 
 class User(Model):
+    """A user, stored under their checksummed wallet address as document ID."""
+
     __collection__ = "users"
     wallet_address: str
     world_id: Optional[str] = None
     visited_restaurants: list[RestaurantID] = []
-    reviews: list[Review] = []
     tummy_token_id: Optional[int] = -1
     profile_picture_url: Optional[str] = None
-    tummy_6551_account: Optional[str] = None
\ No newline at end of file
+    tummy_6551_account: Optional[str] = None
+
+    @root_validator(skip_on_failure=True)
+    def key_by_wallet_address(cls, values: dict) -> dict:
+        if values.get("id") is None:
+            values["id"] = values["wallet_address"]
+        return values
+
+    @classmethod
+    def get(cls, wallet_address: str) -> "User":
+        """Point read by wallet address, which must already be checksummed.
+
+        :raise ModelNotFoundError: If the user doesn't exist.
+        """
+        return cls.get_by_doc_id(wallet_address)
+
+
+class Job(Model):
+    __collection__ = "jobs"
+    kind: str
+    args: dict = {}
+    status: str = "queued"
+    attempts: int = 0
+    max_attempts: int = 5
+    error: Optional[str] = None
+    run_after: float = 0
+    lease_expires: float = 0
+    updated_at: float = 0
+    # What earlier attempts already did, e.g. hashes of the transactions they sent, by step
+    progress: dict = {}
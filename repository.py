@@ -0,0 +1,111 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from cachetools import TTLCache
+from google.api_core.exceptions import AlreadyExists
+from google.cloud.firestore import ArrayUnion
+
+from metrics import time_firestore
+from models import Job, Restaurant, Review, User
+from restaurant_cache import CachedPayload, restaurant_cache
+
+# firedantic's models are synchronous; async handlers run them on this bounded pool so a slow
+# Firestore read only ties up one of its threads instead of the event loop
+executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("FIRESTORE_THREADS", 16)),
+    thread_name_prefix="firestore",
+)
+
+
+async def run_sync(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+async def firestore_call(operation: str, fn, *args, **kwargs):
+    """run_sync for calls that go to Firestore, timed under `operation`."""
+    return await run_sync(time_firestore, operation, fn, *args, **kwargs)
+
+
+async def get_restaurants_by_ids(restaurant_ids: list[str]) -> list[Restaurant]:
+    return await firestore_call(
+        "restaurants.get_many", Restaurant.get_many, restaurant_ids
+    )
+
+
+# Recently seen users, only touched from the event loop. Entries are short-lived because the
+# worker process updates users behind this process' back.
+user_cache: TTLCache = TTLCache(
+    maxsize=int(os.environ.get("USER_CACHE_SIZE", 4096)),
+    ttl=float(os.environ.get("USER_CACHE_TTL", 10)),
+)
+
+
+async def get_user(wallet_address: str, fresh: bool = False) -> User:
+    """Returns the user with this checksummed wallet address.
+
+    Pass `fresh=True` to skip the cache.
+    """
+    if not fresh:
+        user = user_cache.get(wallet_address)
+        if user is not None:
+            return user.copy(deep=True)
+    user = await firestore_call("users.get", User.get, wallet_address)
+    user_cache[wallet_address] = user.copy(deep=True)
+    return user
+
+
+async def create_user(
+    user: User, job_queue, id_: str, kind: str, args: dict
+) -> tuple[User, Optional[Job]]:
+    """Stores `user` and queues a job for it, unless the wallet address is already taken.
+
+    Both are written together, so a new user can't be left without its job. Returns the
+    stored user, and the job if the user was created by this call.
+    """
+    try:
+        job = await firestore_call(
+            "users.create",
+            job_queue.create_and_enqueue,
+            user._get_doc_ref(),
+            user.dict(by_alias=True, exclude={"id"}),
+            id_,
+            kind,
+            args,
+        )
+    except AlreadyExists:
+        return await get_user(user.wallet_address, fresh=True), None
+    user_cache[user.wallet_address] = user.copy(deep=True)
+    return user, job
+
+
+async def add_visited_restaurant(wallet_address: str, restaurant_id: str) -> None:
+    """Adds a restaurant to the user's visited restaurants.
+
+    Only that field is written, the worker updates other fields of the same user meanwhile.
+    """
+    await firestore_call(
+        "users.update",
+        User(wallet_address=wallet_address)._get_doc_ref().update,
+        {"visited_restaurants": ArrayUnion([restaurant_id])},
+    )
+    user_cache.pop(wallet_address, None)
+
+
+async def get_cached_restaurants() -> CachedPayload:
+    return await run_sync(restaurant_cache.get_all)
+
+
+async def get_cached_restaurant(restaurant_id: str) -> CachedPayload:
+    return await run_sync(restaurant_cache.get, restaurant_id)
+
+
+async def get_reviews_page(
+    field: str, value: str, limit: int, cursor: Optional[str]
+) -> tuple[list[Review], Optional[str]]:
+    return await firestore_call(
+        "reviews.page", Review.page, field, value, limit, cursor
+    )
@@ -0,0 +1,131 @@
+import hashlib
+import os
+import threading
+from typing import Callable, Optional
+
+from cachetools import TTLCache
+
+from metrics import FIRESTORE_SECONDS
+from models import Restaurant
+
+ALL = "__all__"
+
+
+class CachedPayload:
+    """A value together with its serialized JSON body and ETag."""
+
+    def __init__(self, value, body: bytes) -> None:
+        self.value = value
+        self.body = body
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+class RestaurantCache:
+    """Memory-resident copy of the restaurant catalog.
+
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted past `max_size`. `watch` keeps the cache coherent with writes from
+    other instances by listening to the collection.
+    """
+
+    def __init__(self, ttl: float = 300, max_size: int = 2048) -> None:
+        self._entries: TTLCache = TTLCache(maxsize=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a load that raced with a write is not cached
+        self._generation = 0
+        self._watch = None
+        self._listeners: list[Callable[[str, str, Optional[Restaurant]], None]] = []
+
+    def get_all(self) -> CachedPayload:
+        with self._lock:
+            cached = self._entries.get(ALL)
+            generation = self._generation
+        if cached is not None:
+            return cached
+        with FIRESTORE_SECONDS.labels("restaurants.find").time():
+            restaurants = Restaurant.find()
+        payload = CachedPayload(
+            restaurants,
+            b"[" + b",".join(r.json().encode() for r in restaurants) + b"]",
+        )
+        with self._lock:
+            if generation == self._generation:
+                self._entries[ALL] = payload
+                for restaurant in restaurants:
+                    self._entries[restaurant.id] = CachedPayload(
+                        restaurant, restaurant.json().encode()
+                    )
+        return payload
+
+    def get(self, restaurant_id: str) -> CachedPayload:
+        with self._lock:
+            cached = self._entries.get(restaurant_id)
+            generation = self._generation
+        if cached is not None:
+            return cached
+        with FIRESTORE_SECONDS.labels("restaurants.get").time():
+            restaurant = Restaurant.get_by_doc_id(restaurant_id)
+        payload = CachedPayload(restaurant, restaurant.json().encode())
+        with self._lock:
+            if generation == self._generation:
+                self._entries[restaurant_id] = payload
+        return payload
+
+    def invalidate(self, restaurant_id: Optional[str] = None) -> None:
+        """Drops one restaurant (and the full listing), or everything if no ID is given."""
+        with self._lock:
+            self._generation += 1
+            if restaurant_id is None:
+                self._entries.clear()
+                return
+            self._entries.pop(restaurant_id, None)
+            self._entries.pop(ALL, None)
+
+    def warm(self) -> None:
+        self.get_all()
+
+    def add_listener(
+        self, listener: Callable[[str, str, Optional[Restaurant]], None]
+    ) -> None:
+        """Registers a callback for watched changes.
+
+        It is called with the change type ("ADDED", "MODIFIED" or "REMOVED"), the
+        restaurant ID and the new restaurant (None when removed).
+        """
+        self._listeners.append(listener)
+
+    def watch(self) -> None:
+        """Invalidates entries as documents change in Firestore."""
+        if self._watch is not None:
+            return
+
+        initial = True
+
+        def on_snapshot(_, changes, __) -> None:
+            nonlocal initial
+            # The first snapshot reports every existing document as added
+            if initial:
+                initial = False
+                return
+            for change in changes:
+                self.invalidate(change.document.id)
+                restaurant = None
+                if change.type.name != "REMOVED":
+                    restaurant = Restaurant(
+                        **change.document.to_dict(), id=change.document.id
+                    )
+                for listener in self._listeners:
+                    listener(change.type.name, change.document.id, restaurant)
+
+        self._watch = Restaurant._get_col_ref().on_snapshot(on_snapshot)
+
+    def close(self) -> None:
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+
+restaurant_cache = RestaurantCache(
+    ttl=float(os.environ.get("RESTAURANT_CACHE_TTL", 300)),
+    max_size=int(os.environ.get("RESTAURANT_CACHE_SIZE", 2048)),
+)
@@ -0,0 +1,130 @@
+import heapq
+import math
+import threading
+from typing import Iterable, Optional
+
+from models import Restaurant
+
+EARTH_RADIUS_METERS = 6371000
+METERS_PER_DEGREE = 111320
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in meters."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = (
+        math.sin(dphi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+
+class SpatialIndex:
+    """Grid index over restaurant coordinates.
+
+    Restaurants are bucketed into `cell_size` degree cells, so a radius query
+    only measures distances to restaurants in the cells overlapping its
+    bounding box.
+    """
+
+    def __init__(self, cell_size: float = 0.01) -> None:
+        self.cell_size = cell_size
+        self.built = False
+        self._cells: dict[tuple[int, int], set[str]] = {}
+        self._restaurants: dict[str, tuple[Restaurant, tuple[int, int]]] = {}
+        self._lock = threading.Lock()
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def build(self, restaurants: Iterable[Restaurant]) -> None:
+        with self._lock:
+            self._cells = {}
+            self._restaurants = {}
+            for restaurant in restaurants:
+                self._insert(restaurant)
+            self.built = True
+
+    def upsert(self, restaurant: Restaurant) -> None:
+        with self._lock:
+            self._remove(restaurant.id)
+            self._insert(restaurant)
+
+    def remove(self, restaurant_id: str) -> None:
+        with self._lock:
+            self._remove(restaurant_id)
+
+    def apply_change(
+        self, change_type: str, restaurant_id: str, restaurant: Optional[Restaurant]
+    ) -> None:
+        """Listener for RestaurantCache, keeps the index in step with Firestore."""
+        if restaurant is None:
+            self.remove(restaurant_id)
+        else:
+            self.upsert(restaurant)
+
+    def _insert(self, restaurant: Restaurant) -> None:
+        cell = self._cell(
+            restaurant.geolocation.latitude, restaurant.geolocation.longitude
+        )
+        self._cells.setdefault(cell, set()).add(restaurant.id)
+        self._restaurants[restaurant.id] = (restaurant, cell)
+
+    def _remove(self, restaurant_id: str) -> None:
+        entry = self._restaurants.pop(restaurant_id, None)
+        if entry is None:
+            return
+        _, cell = entry
+        self._cells[cell].discard(restaurant_id)
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def nearby(
+        self,
+        lat: float,
+        lon: float,
+        radius: float,
+        cuisine: Optional[str] = None,
+        limit: int = 50,
+    ) -> list[tuple[float, Restaurant]]:
+        """Returns up to `limit` (distance, restaurant) pairs within `radius` meters, closest first."""
+        lat_span = radius / METERS_PER_DEGREE
+        # Near the poles a degree of longitude shrinks to nothing, clamp to keep the box finite
+        lon_span = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        min_lat, min_lon = self._cell(lat - lat_span, lon - lon_span)
+        max_lat, max_lon = self._cell(lat + lat_span, lon + lon_span)
+        with self._lock:
+            cell_count = (max_lat - min_lat + 1) * (max_lon - min_lon + 1)
+            if cell_count > len(self._cells):
+                # A very wide radius covers more cells than are occupied, walk the occupied ones
+                candidates = [
+                    restaurant
+                    for restaurant, (cell_lat, cell_lon) in self._restaurants.values()
+                    if min_lat <= cell_lat <= max_lat and min_lon <= cell_lon <= max_lon
+                ]
+            else:
+                candidates = [
+                    self._restaurants[restaurant_id][0]
+                    for cell_lat in range(min_lat, max_lat + 1)
+                    for cell_lon in range(min_lon, max_lon + 1)
+                    for restaurant_id in self._cells.get((cell_lat, cell_lon), ())
+                ]
+        if cuisine is not None:
+            cuisine = cuisine.lower()
+            candidates = [r for r in candidates if r.cuisine.lower() == cuisine]
+        in_range = []
+        for restaurant in candidates:
+            distance = haversine(
+                lat,
+                lon,
+                restaurant.geolocation.latitude,
+                restaurant.geolocation.longitude,
+            )
+            if distance <= radius:
+                in_range.append((distance, restaurant))
+        return heapq.nsmallest(limit, in_range, key=lambda pair: pair[0])
+
+
+restaurant_index = SpatialIndex()
@@ -0,0 +1,159 @@
+import os
+
+import pytest
+from eth.chains.base import MiningChain
+from eth.db.atomic import AtomicDB
+from eth.vm.forks import ShanghaiVM
+from eth.vm.message import Message
+from eth_abi import decode
+from eth_utils import to_canonical_address, to_checksum_address
+
+from erc6551 import account_address, account_creation_code, create2_address
+
+IMPLEMENTATION = "0x" + "44" * 20
+TOKEN_CONTRACT = "0x" + "11" * 20
+
+
+# The examples from EIP-1014
+@pytest.mark.parametrize(
+    "deployer, salt, init_code, expected",
+    [
+        ("0x" + "00" * 20, "00" * 32, "00", "0x4D1A2e2bB4F88F0250f26Ffff098B0b30B26BF38"),
+        ("0xdeadbeef" + "00" * 16, "00" * 32, "00", "0xB928f69Bb1D91Cd65274e3c79d8986362984fDA3"),
+        (
+            "0xdeadbeef" + "00" * 16,
+            "00" * 12 + "feed" + "00" * 18,
+            "00",
+            "0xD04116cDd17beBE565EB2422F2497E06cC1C9833",
+        ),
+        ("0x" + "00" * 20, "00" * 32, "deadbeef", "0x70f2b2914A2a4b783FaEFb75f459A580616Fcb5e"),
+        (
+            "0x" + "00" * 16 + "deadbeef",
+            "00" * 28 + "cafebabe",
+            "deadbeef",
+            "0x60f3f640a8508fC6a86d45DF051962668E1e8AC7",
+        ),
+        (
+            "0x" + "00" * 16 + "deadbeef",
+            "00" * 28 + "cafebabe",
+            "deadbeef" * 11,
+            "0x1d8bfDC5D46DC4f61D6b6115972536eBE6A8854C",
+        ),
+        ("0x" + "00" * 20, "00" * 32, "", "0xE33C0C7F7df4809055C3ebA6c09CFe4BaF1BD9e0"),
+    ],
+)
+def test_create2_address(deployer, salt, init_code, expected):
+    assert create2_address(deployer, bytes.fromhex(salt), bytes.fromhex(init_code)) == expected
+
+
+# Deploys its calldata after the first word with CREATE2, salted with that word, and returns
+# the new address, like the registry's createAccount
+FACTORY_CODE = bytes.fromhex(
+    "602036"  # PUSH1 32, CALLDATASIZE
+    "03"  # SUB: init code size
+    "80"  # DUP1
+    "6020"  # PUSH1 32
+    "6000"  # PUSH1 0
+    "37"  # CALLDATACOPY(0, 32, size)
+    "600035"  # CALLDATALOAD(0): salt
+    "90"  # SWAP1
+    "6000"  # PUSH1 0
+    "6000"  # PUSH1 0
+    "f5"  # CREATE2(0, 0, size, salt)
+    "600052"  # MSTORE(0, address)
+    "60206000f3"  # RETURN(0, 32)
+)
+# Returns 42 for any call
+IMPLEMENTATION_CODE = bytes.fromhex("602a60005260206000f3")
+
+
+def test_account_deploys_at_computed_address():
+    # Runs the creation code in an EVM, so a wrong byte in it fails here rather than
+    # being rebuilt from the same constants
+    registry = "0x" + "33" * 20
+    chain = MiningChain.configure(
+        vm_configuration=((0, ShanghaiVM),), chain_id=5
+    ).from_genesis(
+        AtomicDB(),
+        {"difficulty": 0, "gas_limit": 30_000_000, "timestamp": 1, "nonce": bytes(8)},
+        {
+            to_canonical_address(address): {
+                "balance": 0,
+                "nonce": 1,
+                "code": code,
+                "storage": {},
+            }
+            for address, code in (
+                (registry, FACTORY_CODE),
+                (IMPLEMENTATION, IMPLEMENTATION_CODE),
+            )
+        },
+    )
+    state = chain.get_vm().state
+
+    def call(to: bytes, data: bytes) -> bytes:
+        sender = b"\x01" * 20
+        message = Message(
+            gas=10_000_000,
+            to=to,
+            sender=sender,
+            value=0,
+            data=data,
+            code=state.get_code(to),
+        )
+        context = state.get_transaction_context_class()(gas_price=0, origin=sender)
+        computation = state.computation_class.apply_message(state, message, context)
+        computation.raise_if_error()
+        return computation.output
+
+    salt = 1
+    creation_code = account_creation_code(IMPLEMENTATION, 5, TOKEN_CONTRACT, 42, salt)
+    account = call(
+        to_canonical_address(registry), salt.to_bytes(32, "big") + creation_code
+    )[12:]
+    assert to_checksum_address(account) == account_address(
+        registry, IMPLEMENTATION, 5, TOKEN_CONTRACT, 42, salt
+    )
+    # The deployed account ends with the token it is bound to, read by the account's token()
+    code = state.get_code(account)
+    assert decode(["uint256", "uint256", "address", "uint256"], code[-128:]) == (
+        salt,
+        5,
+        TOKEN_CONTRACT,
+        42,
+    )
+    # and forwards calls to the implementation
+    assert int.from_bytes(call(account, b""), "big") == 42
+
+
+@pytest.mark.skipif(
+    not all(
+        name in os.environ
+        for name in (
+            "RPC_HTTP_URL",
+            "ERC6551_REGISTRY_ADDRESS",
+            "ERC6551_ACCOUNT_ADDRESS",
+            "TUMMY_NFT_ADDRESS",
+        )
+    ),
+    reason="needs the deployed registry, set the chain environment variables",
+)
+@pytest.mark.parametrize("token_id", [0, 1, 1234])
+def test_account_address_matches_registry(token_id):
+    from web3 import Web3
+
+    from abi import erc6551_registry_abi, parse_abi
+    from chain import CHAIN_ID
+
+    w3 = Web3(Web3.HTTPProvider(os.environ["RPC_HTTP_URL"]))
+    registry = w3.eth.contract(
+        address=os.environ["ERC6551_REGISTRY_ADDRESS"], abi=parse_abi(erc6551_registry_abi)
+    )
+    args = (
+        os.environ["ERC6551_ACCOUNT_ADDRESS"],
+        CHAIN_ID,
+        os.environ["TUMMY_NFT_ADDRESS"],
+        token_id,
+        1,
+    )
+    assert account_address(registry.address, *args) == registry.functions.account(*args).call()
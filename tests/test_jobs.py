@@ -0,0 +1,154 @@
+import threading
+import time
+
+import pytest
+from google.api_core.exceptions import AlreadyExists
+
+import jobs
+from jobs import SQLiteJobQueue, run_worker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SQLiteJobQueue(str(tmp_path / "jobs.db"))
+
+
+def test_enqueue_is_idempotent(queue):
+    first = queue.enqueue("job-1", "mint", {"n": 1})
+    second = queue.enqueue("job-1", "mint", {"n": 2})
+    assert second.args == first.args == {"n": 1}
+    assert queue.depth() == 1
+
+
+def test_claim_leases_the_job(queue):
+    queue.enqueue("job-1", "mint", {})
+    job = queue.claim()
+    assert job.id == "job-1"
+    assert job.status == "running"
+    assert job.attempts == 1
+    assert queue.claim() is None
+
+
+def test_expired_lease_is_claimed_again(queue, monkeypatch):
+    monkeypatch.setattr(jobs, "LEASE_SECONDS", -1)
+    queue.enqueue("job-1", "mint", {})
+    queue.claim()
+    job = queue.claim()
+    assert job.id == "job-1"
+    assert job.attempts == 2
+
+
+def test_claim_filters_by_kind(queue):
+    queue.enqueue("job-1", "mint", {})
+    queue.enqueue("job-2", "checkin", {})
+    queue.enqueue("job-3", "checkin", {})
+    assert queue.claim_many(10, []) == []
+    assert [job.id for job in queue.claim_many(1, ["checkin"])] == ["job-2"]
+    assert [job.id for job in queue.claim_many(10, ["checkin"])] == ["job-3"]
+    assert queue.claim(["mint"]).id == "job-1"
+
+
+def test_failure_backs_off_then_gives_up(queue):
+    queue.enqueue("job-1", "mint", {})
+    job = queue.claim()
+    before = time.time()
+    queue.fail(job, "boom")
+    job = queue.get("job-1")
+    assert job.status == "queued"
+    assert job.error == "boom"
+    assert job.run_after >= before + jobs.RETRY_BASE_DELAY
+    # Not runnable before its retry time
+    assert queue.claim() is None
+    assert jobs._retry_delay(3) == 4 * jobs._retry_delay(1)
+
+    job.attempts = job.max_attempts
+    queue.fail(job, "boom")
+    assert queue.get("job-1").status == "failed"
+
+
+def test_complete_and_save_progress(queue):
+    queue.enqueue("job-1", "mint", {})
+    job = queue.claim()
+    job.progress["mint"] = "0x01"
+    queue.save_progress(job)
+    assert queue.get("job-1").progress == {"mint": "0x01"}
+    queue.complete(job)
+    job = queue.get("job-1")
+    assert job.status == "done"
+    assert job.progress == {"mint": "0x01"}
+
+
+def test_create_and_enqueue_queues_the_job_first(queue):
+    class DocRef:
+        def create(self, data):
+            raise AlreadyExists("exists")
+
+    with pytest.raises(AlreadyExists):
+        queue.create_and_enqueue(DocRef(), {}, "job-1", "mint", {})
+    assert queue.get("job-1").status == "queued"
+
+
+def run_until_settled(queue, ids, **kwargs):
+    stop = threading.Event()
+    worker = threading.Thread(
+        target=run_worker,
+        args=(queue,),
+        kwargs={"poll_interval": 0.01, "stop": stop, **kwargs},
+    )
+    worker.start()
+    deadline = time.monotonic() + 10
+    try:
+        while time.monotonic() < deadline:
+            if all(queue.get(id_).status in ("done", "failed") for id_ in ids):
+                break
+            time.sleep(0.01)
+    finally:
+        # Each loop finishes the jobs it claimed before stopping
+        stop.set()
+        worker.join()
+    return {id_: queue.get(id_) for id_ in ids}
+
+
+def test_worker_runs_and_retries_jobs(queue, monkeypatch):
+    monkeypatch.setattr(jobs, "RETRY_BASE_DELAY", 0)
+    calls = []
+
+    def mint(job, n):
+        calls.append((job.id, n))
+        if n == 2:
+            raise ValueError("boom")
+
+    queue.enqueue("job-1", "mint", {"n": 1})
+    queue.enqueue("job-2", "mint", {"n": 2})
+    settled = run_until_settled(
+        queue, ["job-1", "job-2"], handlers={"mint": mint}, threads=2
+    )
+    assert settled["job-1"].status == "done"
+    assert settled["job-2"].status == "failed"
+    assert settled["job-2"].attempts == settled["job-2"].max_attempts
+    assert settled["job-2"].error == "ValueError('boom')"
+    assert calls.count(("job-1", 1)) == 1
+
+
+def test_worker_batches_jobs_and_fails_only_the_reported_ones(queue, monkeypatch):
+    monkeypatch.setattr(jobs, "RETRY_BASE_DELAY", 60)
+    batches = []
+
+    def checkins(batch):
+        batches.append(sorted(job.id for job in batch))
+        return {"job-2": ValueError("boom")}
+
+    for id_ in ("job-1", "job-2", "job-3"):
+        queue.enqueue(id_, "checkin", {})
+    settled = run_until_settled(
+        queue,
+        ["job-1", "job-3"],
+        handlers={"checkin": None},
+        threads=1,
+        batch_handlers={"checkin": checkins},
+        batch_size=10,
+    )
+    assert batches == [["job-1", "job-2", "job-3"]]
+    assert settled["job-1"].status == settled["job-3"].status == "done"
+    assert queue.get("job-2").status == "queued"
+    assert queue.get("job-2").error == "ValueError('boom')"
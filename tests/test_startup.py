@@ -0,0 +1,91 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+# Cold start budget for importing app.py, which used to take ~1.2s with web3 loaded eagerly
+IMPORT_SECONDS_LIMIT = 2.0
+CHAIN_ENV = (
+    "RPC_HTTP_URL",
+    "DEPLOYER_PRIVATE_KEY",
+    "DEPLOYER_ADDRESS",
+    "TUMMY_NFT_ADDRESS",
+    "PROOF_OF_SNACK_NFT_ADDRESS",
+    "ERC6551_REGISTRY_ADDRESS",
+    "ERC6551_ACCOUNT_ADDRESS",
+)
+
+# Runs in a fresh interpreter, so what app.py imports isn't hidden by other tests' imports
+STARTUP_CHECK = textwrap.dedent(
+    """
+    import json
+    import sys
+    import threading
+    import time
+
+    import dotenv
+
+    # A developer's .env must not bring the chain settings back
+    dotenv.load_dotenv = lambda *args, **kwargs: False
+
+    started = time.perf_counter()
+    import app
+
+    import_seconds = time.perf_counter() - started
+    web3_imported = "web3" in sys.modules
+
+    from fastapi.testclient import TestClient
+    from restaurant_cache import restaurant_cache
+
+    def no_firestore():
+        raise RuntimeError("No Firestore in this test")
+
+    restaurant_cache.warm = no_firestore
+    restaurant_cache.watch = lambda: None
+    # Keeps the chain setup pending for as long as the client is open
+    chain_ready = threading.Event()
+    app.warm_chain = chain_ready.wait
+    with TestClient(app.app) as client:
+        response = client.get("/.well-known/apple-app-site-association")
+        chain_pending = not chain_ready.is_set()
+        chain_ready.set()
+    print(
+        json.dumps(
+            {
+                "import_seconds": import_seconds,
+                "web3_imported": web3_imported,
+                "status_code": response.status_code,
+                "chain_pending": chain_pending,
+            }
+        )
+    )
+    """
+)
+
+
+def test_cold_start_without_chain(tmp_path, record_property):
+    env = {name: value for name, value in os.environ.items() if name not in CHAIN_ENV}
+    env.update(
+        FIRESTORE_EMULATOR_HOST="localhost:8080",
+        GOOGLE_CLOUD_PROJECT="snacks-test",
+        JOB_QUEUE_SQLITE_PATH=str(tmp_path / "jobs.db"),
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_CHECK],
+        cwd=Path(__file__).parent.parent,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    startup = json.loads(result.stdout.splitlines()[-1])
+    record_property("import_seconds", startup["import_seconds"])
+    print(f"import app: {startup['import_seconds'] * 1000:.0f} ms")
+
+    assert not startup["web3_imported"]
+    assert startup["status_code"] == 200
+    assert startup["chain_pending"]
+    assert startup["import_seconds"] < IMPORT_SECONDS_LIMIT
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+from thefork_scraper import Restaurant, parse_restaurant_page, parse_search_page
+
+FIXTURES = Path(__file__).parent / "fixtures"
+PAGE_URL = "https://www.thefork.com/search?cityId=415144&p=1"
+
+
+def test_parse_search_page():
+    html = (FIXTURES / "thefork_search.html").read_text()
+    assert parse_search_page(html, PAGE_URL) == [
+        Restaurant(
+            "Le Petit Bistro",
+            "https://www.thefork.com/restaurant/le-petit-bistro-r12345",
+            9.2,
+            "French",
+            "12 Rue de Rivoli, 75004 Paris",
+        ),
+        Restaurant(
+            "Sushi Yoshi",
+            "https://www.thefork.com/restaurant/sushi-yoshi-r678",
+            8.7,
+            "Japanese",
+            "3 Rue Sainte-Anne, 75001 Paris",
+        ),
+    ]
+
+
+def test_parse_search_page_dedupes_cards():
+    page = (FIXTURES / "thefork_search.html").read_text()
+    # The same card once with a relative and once with an absolute link
+    html = page + page.replace(
+        'href="/restaurant/le-petit-bistro-r12345"',
+        'href="https://www.thefork.com/restaurant/le-petit-bistro-r12345"',
+    )
+    assert [r.name for r in parse_search_page(html, PAGE_URL)] == [
+        "Le Petit Bistro",
+        "Sushi Yoshi",
+    ]
+
+
+def test_parse_restaurant_page():
+    html = (FIXTURES / "thefork_restaurant.html").read_text()
+    assert parse_restaurant_page(html) == ("48.8559", "2.3601")
+
+
+def test_parse_restaurant_page_without_coordinates():
+    assert parse_restaurant_page("<html><head><title>Closed</title></head></html>") is None
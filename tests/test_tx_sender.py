@@ -0,0 +1,179 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from eth_utils import keccak
+from web3 import Web3
+from web3.exceptions import TransactionNotFound
+
+from tx_sender import GAS_LIMIT_MARGIN, TransactionReverted, TransactionSender
+
+ADDRESS = "0x" + "aa" * 20
+
+
+class StubEth:
+    """The parts of w3.eth the sender uses, with transactions mined on demand."""
+
+    def __init__(self) -> None:
+        self.chain_nonce = 0
+        self.broadcasts = []
+        # Errors for the next broadcasts, with whether the node took the transaction anyway
+        self.broadcast_errors = []
+        self.pending = set()
+        self.receipts = {}
+        self.account = SimpleNamespace(sign_transaction=self.sign_transaction)
+
+    def sign_transaction(self, tx, private_key):
+        raw = repr(sorted(tx.items())).encode()
+        return SimpleNamespace(hash=keccak(raw), rawTransaction=raw, tx=tx)
+
+    def get_transaction_count(self, address, block_identifier):
+        return self.chain_nonce
+
+    def send_raw_transaction(self, raw):
+        self.broadcasts.append(raw)
+        tx_hash = keccak(raw)
+        if self.broadcast_errors:
+            error, accepted = self.broadcast_errors.pop(0)
+            if accepted:
+                self.pending.add(tx_hash)
+            raise error
+        self.pending.add(tx_hash)
+        return tx_hash
+
+    def get_transaction(self, tx_hash):
+        if _bytes(tx_hash) not in self.pending | set(self.receipts):
+            raise TransactionNotFound("not found")
+        return {}
+
+    def get_transaction_receipt(self, tx_hash):
+        if _bytes(tx_hash) not in self.receipts:
+            raise TransactionNotFound("no receipt")
+        return self.receipts[_bytes(tx_hash)]
+
+    def mine(self, tx_hash, status=1):
+        self.pending.discard(_bytes(tx_hash))
+        self.receipts[_bytes(tx_hash)] = {"status": status, "transactionHash": _bytes(tx_hash)}
+
+
+def _bytes(tx_hash) -> bytes:
+    return Web3.to_bytes(hexstr=tx_hash) if isinstance(tx_hash, str) else bytes(tx_hash)
+
+
+class ContractFunction:
+    def __init__(self, gas: int = 100000) -> None:
+        self.gas = gas
+
+    def estimate_gas(self, transaction):
+        return self.gas
+
+    def build_transaction(self, transaction):
+        return {**transaction, "to": "0x" + "11" * 20, "data": "0x"}
+
+
+@pytest.fixture
+def eth():
+    return StubEth()
+
+
+@pytest.fixture
+def sender(eth):
+    w3 = SimpleNamespace(eth=eth, to_wei=Web3.to_wei)
+    return TransactionSender(w3, ADDRESS, "key", 5, poll_latency=0.01, receipt_timeout=5)
+
+
+def sent_nonces(eth):
+    return [dict(eval(raw.decode()))["nonce"] for raw in eth.broadcasts]
+
+
+def test_send_hands_out_consecutive_nonces(sender, eth):
+    eth.chain_nonce = 7
+    sender.send(ContractFunction())
+    sender.send(ContractFunction())
+    assert sent_nonces(eth) == [7, 8]
+
+
+def test_send_scales_the_estimated_gas(sender, eth):
+    sender.send(ContractFunction(gas=1000000))
+    tx = dict(eval(eth.broadcasts[0].decode()))
+    assert tx["gas"] == int(1000000 * GAS_LIMIT_MARGIN)
+    assert tx["from"] == Web3.to_checksum_address(ADDRESS)
+
+
+def test_rejected_nonce_is_resynced(sender, eth):
+    sender.send(ContractFunction())
+    # Another process used nonces 1 and 2 meanwhile
+    eth.chain_nonce = 3
+    eth.broadcast_errors.append((ValueError("nonce too low"), False))
+    sender.send(ContractFunction())
+    assert sent_nonces(eth) == [0, 1, 3]
+
+
+def test_unrelated_broadcast_error_is_raised(sender, eth):
+    eth.broadcast_errors.append((ValueError("insufficient funds"), False))
+    with pytest.raises(ValueError, match="insufficient funds"):
+        sender.send(ContractFunction())
+    assert len(eth.broadcasts) == 1
+
+
+def test_accepted_transaction_is_tracked_despite_broadcast_error(sender, eth):
+    eth.broadcast_errors.append((TimeoutError("read timed out"), True))
+    future = sender.send(ContractFunction())
+    eth.mine(future.tx_hash)
+    assert future.result(timeout=5)["status"] == 1
+    sender.send(ContractFunction())
+    # Neither re-signed nor sent again, and the next transaction takes the next nonce
+    assert sent_nonces(eth) == [0, 1]
+
+
+def test_already_known_transaction_is_not_sent_again(sender, eth):
+    eth.broadcast_errors.append((ValueError("already known"), False))
+    future = sender.send(ContractFunction())
+    assert future.tx_hash == Web3.to_hex(keccak(eth.broadcasts[0]))
+    assert len(eth.broadcasts) == 1
+
+
+def test_reverted_transaction_fails_its_future(sender, eth):
+    future = sender.send(ContractFunction())
+    eth.mine(future.tx_hash, status=0)
+    with pytest.raises(TransactionReverted):
+        future.result(timeout=5)
+
+
+def test_missing_receipt_times_out_and_resyncs(sender, eth):
+    sender.receipt_timeout = 0.2
+    resynced = threading.Event()
+    get_transaction_count = eth.get_transaction_count
+
+    def count_and_signal(address, block_identifier):
+        if eth.broadcasts:
+            resynced.set()
+        return get_transaction_count(address, block_identifier)
+
+    eth.get_transaction_count = count_and_signal
+    future = sender.send(ContractFunction())
+    # The transaction is dropped and the chain moves on without it
+    eth.pending.clear()
+    eth.chain_nonce = 9
+    with pytest.raises(TimeoutError):
+        future.result(timeout=5)
+    assert resynced.wait(timeout=5)
+    sender.send(ContractFunction())
+    assert sent_nonces(eth) == [0, 9]
+
+
+def test_resume(sender, eth):
+    mined = sender.send(ContractFunction())
+    eth.mine(mined.tx_hash)
+    mined.result(timeout=5)
+    assert sender.resume(mined.tx_hash).result(timeout=0)["status"] == 1
+
+    pending = sender.send(ContractFunction())
+    resumed = sender.resume(pending.tx_hash)
+    eth.mine(pending.tx_hash)
+    assert resumed.result(timeout=5)["status"] == 1
+
+    reverted = sender.send(ContractFunction())
+    eth.mine(reverted.tx_hash, status=0)
+    assert sender.resume(reverted.tx_hash) is None
+    assert sender.resume(Web3.to_hex(keccak(b"dropped"))) is None
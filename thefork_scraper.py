@@ -1,62 +1,321 @@
-from dataclasses import dataclass
+import argparse
+import csv
+import json
+import os
+import random
+import threading
 import time
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import astuple, dataclass
+from html.parser import HTMLParser
+from typing import Optional
+from urllib.parse import urljoin
 
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.common.by import By
+SEARCH_URL = "https://www.thefork.com/search?cityId={city_id}&p={page}"
+
+useragentarray = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/107.0.0.0 Safari/537.36",
+]
 
 
 @dataclass
 class Restaurant:
+    # Same columns, in the same order, as restaurant_data.csv
     name: str
     url: str
     rating: float
     cuisine: str
     address: str
+    latitude: str = ""
+    longitude: str = ""
+    poap_uri: str = ""
 
-URL = "https://www.thefork.com/search?cityId=415144"
-options = webdriver.ChromeOptions()
-options.add_argument('--ignore-certificate-errors')
-options.add_argument('--incognito')
-# Adding argument to disable the AutomationControlled flag 
-options.add_argument("--disable-blink-features=AutomationControlled") 
-# Exclude the collection of enable-automation switches 
-options.add_experimental_option("excludeSwitches", ["enable-automation"]) 
-# Turn-off userAutomationExtension 
-options.add_experimental_option("useAutomationExtension", False) 
-# options.add_experimental_option("detach", True)
-# options.add_argument('--headless')
-driver = webdriver.Chrome(options=options)
-driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})") 
-# page_source = driver.page_source
-# print(page_source)
-
-useragentarray = [ 
-	"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36", 
-	"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/107.0.0.0 Safari/537.36", 
-]
-restaurants = []
-print("name,url,rating,cuisine,address")
-for i in range(2):
-    # Setting user agent iteratively as Chrome 108 and 107
-    driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": useragentarray[i % 2]}) 
-    driver.get(f"{URL}&p={i+1}")
-    WebDriverWait(driver, timeout=60).until(lambda d: d.find_element(By.ID,"srp-filters-container"))
-    restaurants_elems = driver.find_elements(By.XPATH, "//div[contains(@class, 'content')]")
-    for restaurant in restaurants_elems:
+
+class Element:
+    def __init__(self, tag: str, attrs: dict, parent: Optional["Element"]) -> None:
+        self.tag = tag
+        self.attrs = attrs
+        self.parent = parent
+        self.children: list["Element"] = []
+        self.text_parts: list[str] = []
+
+    @property
+    def text(self) -> str:
+        return " ".join(
+            " ".join(part.split())
+            for part in self._texts()
+            if part.strip()
+        )
+
+    def _texts(self):
+        yield from self.text_parts
+        for child in self.children:
+            yield from child._texts()
+
+    def iter(self, tag: Optional[str] = None):
+        for child in self.children:
+            if tag is None or child.tag == tag:
+                yield child
+            yield from child.iter(tag)
+
+    def find(self, tag: str, **attrs) -> Optional["Element"]:
+        for element in self.iter(tag):
+            if all(element.attrs.get(k) == v for k, v in attrs.items()):
+                return element
+        return None
+
+
+class TreeBuilder(HTMLParser):
+    """Builds a small element tree, enough to query the search page without a browser."""
+
+    VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "wbr"}
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.root = Element("document", {}, None)
+        self.current = self.root
+
+    def handle_starttag(self, tag, attrs) -> None:
+        element = Element(tag, {k: v or "" for k, v in attrs}, self.current)
+        self.current.children.append(element)
+        if tag not in self.VOID_TAGS:
+            self.current = element
+
+    def handle_endtag(self, tag) -> None:
+        # Walk up to the matching open tag, tolerating unclosed children
+        element = self.current
+        while element is not None and element.tag != tag:
+            element = element.parent
+        if element is not None and element.parent is not None:
+            self.current = element.parent
+
+    def handle_data(self, data) -> None:
+        self.current.text_parts.append(data)
+
+
+def parse_html(html: str) -> Element:
+    builder = TreeBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+
+def parse_search_page(html: str, page_url: str) -> list[Restaurant]:
+    """Extracts the restaurant cards from a TheFork search results page loaded from `page_url`."""
+    restaurants = []
+    seen = set()
+    for card in parse_html(html).iter("div"):
+        if "content" not in card.attrs.get("class", ""):
+            continue
+        heading = card.find("h2")
+        link = heading.find("a") if heading else None
+        cuisine = card.find("span", **{"data-test": "search-restaurant-tags-DEFAULT"})
+        divs = [child for child in card.children if child.tag == "div"]
+        address = divs[1].find("p") if len(divs) > 1 else None
+        rating = _rating(card)
+        if link is None or cuisine is None or address is None or rating is None:
+            continue
+        # Links are usually relative, the browser used to resolve them against the page
+        url = urljoin(page_url, link.attrs.get("href", ""))
+        # A wrapper div whose class also mentions "content" would yield the same card again
+        if url in seen:
+            continue
+        seen.add(url)
+        restaurants.append(Restaurant(link.text, url, rating, cuisine.text, address.text))
+    return restaurants
+
+
+def _rating(card: Element) -> Optional[float]:
+    # The rating is the first number in a div > span > span
+    for span in card.iter("span"):
+        if span.parent.tag == "span" and span.parent.parent.tag == "div":
+            try:
+                return float(span.text.replace(",", "."))
+            except ValueError:
+                continue
+    return None
+
+
+def parse_restaurant_page(html: str) -> Optional[tuple[str, str]]:
+    """Returns (latitude, longitude) from the schema.org data on a restaurant page."""
+    for script in parse_html(html).iter("script"):
+        if script.attrs.get("type") != "application/ld+json":
+            continue
         try:
-            name = restaurant.find_element(By.XPATH, ".//h2/a").text
-            url = restaurant.find_element(By.XPATH, ".//h2/a").get_attribute("href")
-            cuisine = restaurant.find_element(By.XPATH, ".//span[@data-test='search-restaurant-tags-DEFAULT']").text
-            rating = restaurant.find_element(By.XPATH, ".//div/span/span").text
-            address = restaurant.find_element(By.XPATH, "./div[2]//p").text
-            print(f'"{name}",{url},{rating},{cuisine},"{address}"')
-            # restaurants.append(Restaurant(name, url, rating, cuisine, address))
-        except:
+            data = json.loads("".join(script.text_parts))
+        except ValueError:
             continue
-    time.sleep(10)
-    # print(f"Page {i+1} loaded")
+        for item in data if isinstance(data, list) else [data]:
+            geo = item.get("geo") if isinstance(item, dict) else None
+            if geo and "latitude" in geo and "longitude" in geo:
+                return str(geo["latitude"]), str(geo["longitude"])
+    return None
+
+
+class RateLimiter:
+    """Shared delay between page loads across all workers.
+
+    The delay doubles whenever a worker fails (likely throttled) and shrinks
+    a little after every success, within [min_delay, max_delay].
+    """
+
+    def __init__(self, min_delay: float = 2, max_delay: float = 120) -> None:
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = min_delay
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.delay
+        # Jitter so the workers don't hit the site in lockstep
+        time.sleep(slot - now + random.uniform(0, self.delay / 4))
+
+    def success(self) -> None:
+        with self._lock:
+            self.delay = max(self.min_delay, self.delay * 0.9)
+
+    def failure(self) -> None:
+        with self._lock:
+            self.delay = min(self.max_delay, self.delay * 2)
+
+
+class Checkpoint:
+    """Remembers which (city, page) pairs are done, so a restarted run skips them."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self.done: set[str] = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done = set(json.load(f))
+
+    def mark(self, key: str) -> None:
+        with self._lock:
+            self.done.add(key)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(sorted(self.done), f)
+            os.replace(self.path + ".tmp", self.path)
+
+
+def make_driver():
+    from selenium import webdriver
+
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless=new")
+    options.add_argument("--ignore-certificate-errors")
+    options.add_argument("--incognito")
+    # Adding argument to disable the AutomationControlled flag
+    options.add_argument("--disable-blink-features=AutomationControlled")
+    # Exclude the collection of enable-automation switches
+    options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    # Turn-off userAutomationExtension
+    options.add_experimental_option("useAutomationExtension", False)
+    driver = webdriver.Chrome(options=options)
+    driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+    driver.execute_cdp_cmd(
+        "Network.setUserAgentOverride", {"userAgent": random.choice(useragentarray)}
+    )
+    return driver
+
+
+class Scraper:
+    def __init__(
+        self,
+        output: str,
+        checkpoint: str,
+        workers: int = 4,
+        with_coordinates: bool = False,
+        max_attempts: int = 4,
+    ) -> None:
+        self.output = output
+        self.checkpoint = Checkpoint(checkpoint)
+        self.workers = workers
+        self.with_coordinates = with_coordinates
+        self.max_attempts = max_attempts
+        self.rate_limiter = RateLimiter()
+        self._local = threading.local()
+        self._drivers = []
+        self._output_lock = threading.Lock()
+
+    def _driver(self):
+        if not hasattr(self._local, "driver"):
+            self._local.driver = make_driver()
+            self._drivers.append(self._local.driver)
+        return self._local.driver
+
+    def _load(self, url: str, ready_selector: Optional[str] = None) -> str:
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.wait import WebDriverWait
+
+        self.rate_limiter.wait()
+        driver = self._driver()
+        driver.get(url)
+        if ready_selector is not None:
+            WebDriverWait(driver, timeout=60).until(
+                lambda d: d.find_element(By.ID, ready_selector)
+            )
+        return driver.page_source
+
+    def scrape_page(self, city_id: str, page: int) -> None:
+        key = f"{city_id}:{page}"
+        if key in self.checkpoint.done:
+            return
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                url = SEARCH_URL.format(city_id=city_id, page=page)
+                restaurants = parse_search_page(self._load(url, "srp-filters-container"), url)
+                if self.with_coordinates:
+                    for restaurant in restaurants:
+                        coordinates = parse_restaurant_page(self._load(restaurant.url))
+                        if coordinates is not None:
+                            restaurant.latitude, restaurant.longitude = coordinates
+            except Exception as e:
+                self.rate_limiter.failure()
+                print(f"Page {key} failed (attempt {attempt}): {e!r}")
+                continue
+            self.rate_limiter.success()
+            with self._output_lock:
+                with open(self.output, "a", newline="") as f:
+                    csv.writer(f).writerows(astuple(r) for r in restaurants)
+            # Only checkpoint once the rows are on disk
+            self.checkpoint.mark(key)
+            print(f"Page {key}: {len(restaurants)} restaurants")
+            return
+        print(f"Giving up on page {key}, re-run to retry it")
+
+    def run(self, city_ids: list[str], pages: int) -> None:
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for city_id in city_ids:
+                    for page in range(1, pages + 1):
+                        executor.submit(self.scrape_page, city_id, page)
+        finally:
+            for driver in self._drivers:
+                driver.quit()
+
 
-# print(*restaurants, sep="\n")
-driver.close()
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape TheFork search results into a CSV")
+    parser.add_argument("--cities", nargs="+", default=["415144"], help="TheFork city IDs")
+    parser.add_argument("--pages", type=int, default=2, help="Search pages per city")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent headless browsers")
+    parser.add_argument("--output", default="scraped_restaurants.csv")
+    parser.add_argument("--checkpoint", help="Defaults to <output>.checkpoint")
+    parser.add_argument(
+        "--with-coordinates",
+        action="store_true",
+        help="Visit each restaurant page to fill in latitude and longitude",
+    )
+    args = parser.parse_args()
+    Scraper(
+        args.output,
+        args.checkpoint or f"{args.output}.checkpoint",
+        workers=args.workers,
+        with_coordinates=args.with_coordinates,
+    ).run(args.cities, args.pages)
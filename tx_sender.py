@@ -0,0 +1,191 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional
+
+from web3 import Web3
+from web3.exceptions import TransactionNotFound
+
+# Errors returned by the node when our local nonce is out of step with the chain
+NONCE_ERRORS = (
+    "nonce too low",
+    "nonce too high",
+    "replacement transaction underpriced",
+    "invalid nonce",
+)
+# Headroom over the estimate, state can change between estimating and mining
+GAS_LIMIT_MARGIN = 1.2
+
+
+class TransactionReverted(Exception):
+    """The transaction was mined but reverted (receipt status 0)."""
+
+    def __init__(self, receipt) -> None:
+        super().__init__(f"Transaction {receipt['transactionHash'].hex()} reverted")
+        self.receipt = receipt
+
+
+class TransactionSender:
+    """Sends transactions for a single key without blocking on receipts.
+
+    Nonces are handed out from a local counter so several transactions can be in
+    flight at once; receipts are collected by one polling thread and delivered
+    through futures. A reverted transaction fails its future with TransactionReverted.
+    """
+
+    def __init__(
+        self,
+        w3: Web3,
+        address: str,
+        private_key: str,
+        chain_id: int,
+        max_retries: int = 3,
+        poll_latency: float = 1.0,
+        receipt_timeout: float = 300,
+    ) -> None:
+        self.w3 = w3
+        self.address = Web3.to_checksum_address(address)
+        self.private_key = private_key
+        self.chain_id = chain_id
+        self.max_retries = max_retries
+        self.poll_latency = poll_latency
+        self.receipt_timeout = receipt_timeout
+        self._nonce: int | None = None
+        self._nonce_lock = threading.Lock()
+        self._pending: dict[bytes, tuple[Future, float]] = {}
+        self._pending_lock = threading.Lock()
+        self._poller: threading.Thread | None = None
+
+    def tx_params(self) -> dict:
+        return {
+            "chainId": self.chain_id,
+            "from": self.address,
+            "maxFeePerGas": self.w3.to_wei("20", "gwei"),
+            "maxPriorityFeePerGas": self.w3.to_wei("10", "gwei"),
+        }
+
+    def resync_nonce(self) -> None:
+        with self._nonce_lock:
+            self._nonce = self.w3.eth.get_transaction_count(self.address, "pending")
+
+    def send(self, contract_function) -> Future:
+        """Signs and broadcasts a contract call, returning a future for its receipt.
+
+        The future's `tx_hash` attribute holds the transaction hash as a hex string.
+        The gas limit is estimated, so a call that would revert raises here instead.
+        """
+        # Estimated outside the nonce lock, it's an RPC round trip
+        gas = contract_function.estimate_gas({"from": self.address})
+        for attempt in range(self.max_retries + 1):
+            with self._nonce_lock:
+                if self._nonce is None:
+                    self._nonce = self.w3.eth.get_transaction_count(
+                        self.address, "pending"
+                    )
+                nonce = self._nonce
+                tx = contract_function.build_transaction(
+                    {
+                        **self.tx_params(),
+                        "gas": int(gas * GAS_LIMIT_MARGIN),
+                        "nonce": nonce,
+                    }
+                )
+                signed_tx = self.w3.eth.account.sign_transaction(
+                    tx, private_key=self.private_key
+                )
+                # Known before the broadcast, so a transaction the node took despite an
+                # error is still tracked instead of being sent again under a new nonce
+                tx_hash = signed_tx.hash
+                try:
+                    self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
+                except Exception as e:
+                    if not self._was_broadcast(tx_hash, e):
+                        # Whatever went wrong, the node is now the source of truth for
+                        # the next nonce; holding on to ours would stall every later tx.
+                        self._nonce = None
+                        if attempt < self.max_retries and _is_nonce_error(e):
+                            print(f"Nonce {nonce} rejected ({e}), resyncing")
+                            continue
+                        raise
+                    print(f"Broadcast of {tx_hash.hex()} failed ({e}), but the node has it")
+                self._nonce = nonce + 1
+            return self._track(tx_hash)
+
+    def _was_broadcast(self, tx_hash: bytes, error: Exception) -> bool:
+        if "already known" in str(error).lower():
+            # This exact transaction is already pending
+            return True
+        try:
+            self.w3.eth.get_transaction(tx_hash)
+        except Exception:
+            return False
+        return True
+
+    def resume(self, tx_hash: str) -> Optional[Future]:
+        """Returns a receipt future for a transaction sent earlier, e.g. by a previous process.
+
+        Returns None if the transaction reverted or was dropped, and has to be sent again.
+        """
+        try:
+            receipt = self.w3.eth.get_transaction_receipt(tx_hash)
+        except TransactionNotFound:
+            try:
+                self.w3.eth.get_transaction(tx_hash)
+            except TransactionNotFound:
+                return None
+            # Still pending
+            return self._track(Web3.to_bytes(hexstr=tx_hash))
+        if receipt["status"] == 0:
+            return None
+        future: Future = Future()
+        future.tx_hash = tx_hash
+        future.set_result(receipt)
+        return future
+
+    def _track(self, tx_hash: bytes) -> Future:
+        future: Future = Future()
+        future.tx_hash = Web3.to_hex(tx_hash)
+        with self._pending_lock:
+            self._pending[bytes(tx_hash)] = (future, time.monotonic())
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._poll_receipts, daemon=True)
+                self._poller.start()
+        return future
+
+    def _poll_receipts(self) -> None:
+        while True:
+            with self._pending_lock:
+                if not self._pending:
+                    self._poller = None
+                    return
+                pending = list(self._pending.items())
+            for tx_hash, (future, sent_at) in pending:
+                try:
+                    receipt = self.w3.eth.get_transaction_receipt(tx_hash)
+                except TransactionNotFound:
+                    if time.monotonic() - sent_at < self.receipt_timeout:
+                        continue
+                    self._resolve(tx_hash).set_exception(
+                        TimeoutError(f"No receipt for {tx_hash.hex()}")
+                    )
+                    # A dropped transaction leaves a nonce gap behind it
+                    self.resync_nonce()
+                    continue
+                except Exception as e:
+                    print(f"Receipt poll for {tx_hash.hex()} failed: {e}")
+                    continue
+                if receipt["status"] == 0:
+                    self._resolve(tx_hash).set_exception(TransactionReverted(receipt))
+                else:
+                    self._resolve(tx_hash).set_result(receipt)
+            time.sleep(self.poll_latency)
+
+    def _resolve(self, tx_hash: bytes) -> Future:
+        with self._pending_lock:
+            future, _ = self._pending.pop(tx_hash)
+        return future
+
+
+def _is_nonce_error(e: Exception) -> bool:
+    message = str(e).lower()
+    return any(error in message for error in NONCE_ERRORS)
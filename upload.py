@@ -1,16 +1,119 @@
+import argparse
 import csv
+import hashlib
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
 
-from models import Restaurant
-
+from pydantic import ValidationError
 from google.cloud.firestore import Client
 from firedantic import configure
 
-client = Client()
+from models import Restaurant
+
+COLUMNS = ["name", "url", "rating", "cuisine", "address", "latitude", "longitude", "poap_uri"]
+# Firestore rejects batched writes of more than 500 operations
+MAX_BATCH_SIZE = 500
+THEFORK_ID = re.compile(r"-r(\d+)/?$")
+
+
+def restaurant_key(url: str) -> str:
+    """Stable document ID for a restaurant, derived from its TheFork URL."""
+    match = THEFORK_ID.search(url)
+    if match:
+        return f"thefork-{match.group(1)}"
+    return "url-" + hashlib.sha1(url.encode()).hexdigest()
+
+
+def read_restaurants(path: str) -> Iterator[Restaurant]:
+    """Streams valid restaurants from the CSV, reporting and skipping invalid rows."""
+    with open(path, newline="") as f:
+        for line_number, row in enumerate(csv.reader(f), start=1):
+            if len(row) != len(COLUMNS):
+                print(f"Line {line_number}: expected {len(COLUMNS)} columns, got {len(row)}")
+                continue
+            fields = dict(zip(COLUMNS, row))
+            try:
+                yield Restaurant(
+                    name=fields["name"],
+                    url=fields["url"],
+                    rating=fields["rating"],
+                    cuisine=fields["cuisine"],
+                    address=fields["address"],
+                    geolocation={
+                        "latitude": fields["latitude"],
+                        "longitude": fields["longitude"],
+                    },
+                    poap_uri=fields["poap_uri"],
+                )
+            except ValidationError as e:
+                print(f"Line {line_number}: {e}")
+
+
+def existing_keys() -> dict[str, str]:
+    # Restaurants loaded before keys were derived from URLs keep their auto-generated IDs,
+    # since users and reviews already refer to them
+    return {
+        doc.get("url"): doc.id
+        for doc in Restaurant._get_col_ref().select(["url"]).stream()
+    }
+
+
+def upload(path: str, batch_size: int = MAX_BATCH_SIZE, concurrency: int = 4) -> int:
+    client = Client()
+    configure(client, prefix="snacks-")
+    keys = existing_keys()
+    col_ref = Restaurant._get_col_ref()
+    # Bounds the number of batches held in memory while earlier ones are committing
+    in_flight = threading.BoundedSemaphore(concurrency * 2)
+    written = 0
+    written_lock = threading.Lock()
+    started = time.monotonic()
+
+    def commit(batch, size: int) -> None:
+        nonlocal written
+        try:
+            batch.commit()
+            with written_lock:
+                written += size
+            elapsed = time.monotonic() - started
+            print(f"{written} restaurants written ({written / elapsed:.0f} rows/s)")
+        finally:
+            in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = []
+        batch, size = client.batch(), 0
+        for restaurant in read_restaurants(path):
+            doc_id = keys.get(restaurant.url) or restaurant_key(restaurant.url)
+            # Merging leaves fields maintained elsewhere, such as the rating aggregates, intact
+            batch.set(
+                col_ref.document(doc_id),
+                restaurant.dict(exclude={"id", "rating_count", "rating_sum"}),
+                merge=True,
+            )
+            size += 1
+            if size == batch_size:
+                in_flight.acquire()
+                futures.append(executor.submit(commit, batch, size))
+                batch, size = client.batch(), 0
+        if size:
+            in_flight.acquire()
+            futures.append(executor.submit(commit, batch, size))
+        for future in futures:
+            future.result()
+
+    elapsed = time.monotonic() - started
+    print(f"Done: {written} restaurants in {elapsed:.1f}s ({written / elapsed:.0f} rows/s)")
+    return written
 
-configure(client, prefix="snacks-")
 
-with open("restaurant_data.csv", "r") as f:
-    reader = csv.reader(f.readlines())
-    for line in reader:
-        name, url, rating, cuisine, address, latitude, longitude, poap_uri = line
-        Restaurant(name=name, url=url, rating=float(rating), cuisine=cuisine, address=address, geolocation={"latitude": latitude, "longitude": longitude}, poap_uri=poap_uri).save()
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upsert restaurants from a CSV into Firestore")
+    parser.add_argument("path", nargs="?", default="restaurant_data.csv")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    upload(args.path, min(args.batch_size, MAX_BATCH_SIZE), args.concurrency)
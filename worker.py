@@ -0,0 +1,25 @@
+import os
+
+from prometheus_client import start_http_server
+
+from app import BATCH_JOB_HANDLERS, CHECKIN_BATCH_SIZE, JOB_HANDLERS, job_queue
+from chain import get_chain
+from jobs import run_worker
+
+if __name__ == "__main__":
+    threads = int(os.environ.get("WORKER_THREADS", 8))
+    # The worker has no web server of its own, expose its job and RPC metrics separately.
+    # Falls back to PORT, where platforms such as Cloud Run expect the container to listen.
+    port = os.environ.get("WORKER_METRICS_PORT") or os.environ.get("PORT", 9100)
+    start_http_server(int(port))
+    # Every job needs the chain, so fail on a missing setting now rather than in each job
+    get_chain()
+    print(f"Starting job worker with {threads} threads")
+    batching = os.environ.get("CHECKIN_BATCHING") == "1"
+    run_worker(
+        job_queue,
+        JOB_HANDLERS,
+        threads=threads,
+        batch_handlers=BATCH_JOB_HANDLERS if batching else None,
+        batch_size=CHECKIN_BATCH_SIZE,
+    )